@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import threading
+from contextlib import contextmanager
 import redis
 
 class Client(object):
@@ -25,8 +27,75 @@ def get_client():
     global connection
     return connection
 
+_batches = threading.local()
+
+@contextmanager
+def batch():
+    """
+    Queues the ``save()`` and ``delete()`` of the models made in the
+    block, in the current thread, into a single transaction executed
+    when the block exits. Nothing is written if the block raises.
+
+    The objects are validated and get their id when they are saved, but
+    they are not locked. Nested blocks join the outermost one. If the
+    block raises or its transaction fails, the objects saved in it get
+    back the state they had before (see ``on_batch_abort``).
+
+    >>> from redisco import models
+    >>> class Foo(models.Model):
+    ...     name = models.Attribute()
+    ...
+    >>> with batch():
+    ...     a, b = Foo(name="Obama"), Foo(name="Lincoln")
+    ...     a.save(), b.save()
+    ...     len(Foo.objects.all())
+    (True, True)
+    0
+    >>> len(Foo.objects.all())
+    2
+    >>> Foo.objects.all().delete()
+    2
+    """
+    pipeline = get_batch()
+    if pipeline is not None:
+        yield pipeline
+        return
+    _batches.pipeline = pipeline = get_client().pipeline()
+    _batches.rollbacks = rollbacks = []
+    try:
+        yield pipeline
+        pipeline.execute()
+    except:
+        for callback in reversed(rollbacks):
+            callback()
+        raise
+    finally:
+        pipeline.reset()
+        _batches.pipeline = None
+        _batches.rollbacks = None
+
+def get_batch():
+    """
+    Returns the pipeline of the current ``batch()`` block of the thread,
+    or None outside of a block.
+    """
+    return getattr(_batches, 'pipeline', None)
+
+def on_batch_abort(callback):
+    """
+    Registers ``callback`` to be called, without arguments, if the
+    current ``batch()`` block of the thread raises or its transaction
+    fails. The callbacks are called in the reverse order.
+    """
+    _batches.rollbacks.append(callback)
+
 client = Client()
 connection = client.redis()
 default_expire_time = 60
+default_chunk_size = 100
+write_behind_size = 500
+write_behind_interval = 0.05
+write_behind_exit_timeout = 5
 
-__all__ = ['connection_setup', 'get_client']
+__all__ = ['connection_setup', 'get_client', 'batch', 'get_batch',
+           'on_batch_abort']
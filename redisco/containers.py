@@ -65,7 +65,8 @@ class Container(object):
 
     @property
     def db(self):
-        if self.pipeline:
+        # an empty pipeline is falsy
+        if self.pipeline is not None:
             return self.pipeline
         if self._db:
             return self._db
@@ -729,7 +730,7 @@ class TypedList(object):
 
     def typecast_iter(self, values):
         if self._redisco_model:
-            return filter(lambda o: o is not None, [self.klass.objects.get_by_id(v) for v in values])
+            return self.klass.objects.get_many(values)
         else:
             return [self.klass(v, *self._klass_args, **self._klass_kwargs) for v in values]
 
@@ -763,8 +764,7 @@ class TypedList(object):
         self.list[index] = self.typecast_stor(value)
 
     def __iter__(self):
-        for i in xrange(len(self.list)):
-            yield self[i]
+        return iter(self.all())
 
     def __repr__(self):
         return repr(self.typecast_iter(self.list))
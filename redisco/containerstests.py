@@ -385,6 +385,13 @@ class TypedListTestCase(unittest.TestCase):
                 #self.assertEquals(person.friend, clayg)
                 pass
 
+        ghost = Person.objects.create(name='ghost')
+        l.append(ghost)
+        l.append(iamteam)
+        ghost.delete()
+        self.assertEquals([iamteam, clayg, iamteam], list(l))
+        self.assertEquals([clayg, iamteam], l[1:])
+
 
 class SortedSetTestCase(unittest.TestCase):
     def setUp(self):
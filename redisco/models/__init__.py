@@ -1,9 +1,12 @@
 from base import *
 from attributes import *
 from exceptions import *
+from ids import SnowflakeGenerator
+from writebehind import flush
 
 __all__ = ['Model', 'Attribute', 'BooleanField', 'IntegerField',
         'Counter', 'FloatField', 'DateTimeField', 'DateField',
         'ReferenceField', 'ListField', 'ValidationError', 'from_key',
         'ValidationError', 'MissingID', 'ObjectNotExist', 
-        'AttributeNotIndexed', 'FieldValidationError', 'BadKeyError']
+        'AttributeNotIndexed', 'FieldValidationError', 'BadKeyError',
+        'SnowflakeGenerator', 'flush']
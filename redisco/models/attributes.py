@@ -54,6 +54,9 @@ class Attribute(object):
         try:
             return getattr(instance, '_' + self.name)
         except AttributeError:
+            if self.name in instance._deferred_attrs:
+                instance._load_deferred_attrs()
+                return self.__get__(instance, owner)
             self.__set__(instance, self.default)
             return self.default
 
@@ -92,8 +95,8 @@ class Attribute(object):
         if self.required:
             if val is None or not unicode(val).strip():
                 errors.append((self.name, 'required'))
-        # validate uniquness
-        if val and self.unique:
+        # validate uniquness, which save() enforces when writing
+        if val and self.unique and instance._check_uniques:
             error = self.validate_uniqueness(instance, val)
             if error:
                 errors.append(error)
@@ -110,9 +113,8 @@ class Attribute(object):
             return (self.name, 'unique could not be indexed')
 
         encoded = self.typecast_for_storage(val)
-        match = instance.__class__.objects.get_by_unique(**{self.name: encoded})
-        match_count = 0 if match is None else 1
-        if match_count > (0 if instance.is_new() else 1):
+        owner = instance.db.hget(instance._unique_key_for(self.name), encoded)
+        if owner is not None and (instance.is_new() or owner != instance.id):
             return (self.name, 'not unique',)
 
 
@@ -287,10 +289,11 @@ class ListField(object):
             else:
                 key = instance.key()[self.name]
                 val = List(key).members
+                instance._list_snapshots[self.name] = list(val)
             if val is not None:
                 klass = self.value_type()
                 if self._redisco_model:
-                    val = filter(lambda o: o is not None, [klass.objects.get_by_id(v) for v in val])
+                    val = klass.objects.get_many(val)
                 else:
                     val = [klass(v) for v in val]
             self.__set__(instance, val)
@@ -309,6 +312,9 @@ class ListField(object):
         return self._target_type
 
     def validate(self, instance):
+        if not instance.is_new() and not hasattr(instance, '_' + self.name):
+            # the stored list was validated when it was written
+            return
         val = getattr(instance, self.name)
         errors = []
 
@@ -1,11 +1,16 @@
 import time
 from datetime import datetime, date
 from dateutil.tz import tzutc
+from redis.exceptions import WatchError
 import redisco
 from redisco.containers import Set, List, SortedSet, NonPersistentList
 from attributes import *
 from key import Key
 from managers import ManagerDescriptor, Manager
+from scripts import SAVE_OBJECT
+from changes import ObjectChanges
+from ids import IdBlockAllocator, ID_GENERATORS
+import writebehind
 from exceptions import FieldValidationError, MissingID, ObjectNotExist, BadKeyError
 from attributes import Counter
 
@@ -13,6 +18,10 @@ __all__ = ['Model', 'from_key']
 
 ZINDEXABLE = (IntegerField, DateTimeField, DateField, FloatField)
 
+SAVE_ENGINES = ('mutex', 'optimistic', 'script')
+
+QUERY_ENGINES = ('store', 'script')
+
 ##############################
 # Model Class Initialization #
 ##############################
@@ -45,6 +54,8 @@ def _initialize_referenced(model_class, attribute):
     """
     # this should be a descriptor
     def _related_objects(self):
+        if related_name in self._prefetched:
+            return self._prefetched[related_name]
         return (model_class.objects
                 .filter(**{attribute.attname: self.id}))
 
@@ -56,6 +67,19 @@ def _initialize_referenced(model_class, attribute):
                 model_class.__name__.lower() + '_set')
         setattr(klass, related_name,
                 property(_related_objects))
+        klass._related[related_name] = (model_class, attribute)
+
+
+def _initialize_related(model_class, name, bases, attrs):
+    """
+    Stores the reverse relations installed on the model by the
+    reference fields targeting it, so that they can be prefetched.
+    """
+    model_class._related = {}
+    for parent in bases:
+        if not isinstance(parent, ModelBase):
+            continue
+        model_class._related.update(parent._related)
 
 
 def _initialize_lists(model_class, name, bases, attrs):
@@ -191,9 +215,120 @@ def _initialize_auto_increment(model_class):
     else:
         model_class.auto_increment = True 
 
+def _initialize_id_allocator(model_class):
+    """
+    Initializes the allocation of the ids of the new objects. By default
+    each new object increments the id key of the model.
+    """
+    generator = model_class._meta['id_generator']
+    if isinstance(generator, basestring):
+        if generator not in ID_GENERATORS:
+            raise ValueError("Unknown id generator %s. Choices are: %s" %
+                    (generator, ", ".join(sorted(ID_GENERATORS))))
+        generator = ID_GENERATORS[generator]
+    if generator is not None:
+        # keep functions from being bound to the model
+        generator = staticmethod(generator)
+    model_class._id_generator = generator
+    size = model_class._meta['id_block_size']
+    if size and size > 1:
+        model_class._id_allocator = IdBlockAllocator(model_class._key['id'],
+                                                     size)
+    else:
+        model_class._id_allocator = None
+
+def _initialize_save_engine(model_class):
+    """
+    Initializes the way the objects are protected from concurrent
+    saves. Default is the ``Mutex`` lock key.
+    """
+    engine = model_class._meta['save_engine'] or 'mutex'
+    if engine not in SAVE_ENGINES:
+        raise ValueError("Unknown save engine %s. Choices are: %s" %
+                (engine, ", ".join(SAVE_ENGINES)))
+    model_class._save_engine = engine
+    model_class._save_retries = model_class._meta['save_retries'] or 10
+    model_class._write_behind = bool(model_class._meta['write_behind'])
+    if model_class._write_behind and model_class._uniques:
+        raise ValueError("%s cannot have unique attributes with the "
+                "write_behind option." % model_class.__name__)
+
+def _initialize_query_engine(model_class):
+    """
+    Initializes the way the collections of the model are looked up.
+    Default is the temporary keys of ``ModelSet``.
+    """
+    engine = model_class._meta['query_engine'] or 'store'
+    if engine not in QUERY_ENGINES:
+        raise ValueError("Unknown query engine %s. Choices are: %s" %
+                (engine, ", ".join(QUERY_ENGINES)))
+    model_class._query_engine = engine
+
+def _encode_value(value):
+    """
+    Returns ``value`` as it is sent to Redis, to compare it with the
+    values read back.
+    """
+    if isinstance(value, float):
+        return repr(value)
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
 class ModelOptions(object):
     """Handles options defined in Meta class of the model.
 
+    ``save_engine`` sets how concurrent saves of the same object are
+    handled:
+
+    - ``'mutex'`` (default): a lock key is held during the write
+      (see ``Mutex``).
+    - ``'optimistic'``: the object keys are WATCHed and the write is
+      retried, up to ``save_retries`` times (10 by default), if another
+      client modified them meanwhile. No lock key is involved.
+    - ``'script'``: the object is written by a single Lua script that
+      updates the indices from the ones stored on the server and
+      enforces the uniques atomically.
+
+    ``query_engine`` sets how the collections of the model are looked
+    up:
+
+    - ``'store'`` (default): the intersections, differences and sorts
+      are stored in temporary keys shared by the identical queries.
+    - ``'script'``: a single Lua script computes the ids of the
+      collection, and returns the hashes of the objects along with them
+      when the collection is limited (see ``ModelSet.limit``), in one
+      round trip. Nothing is left on the server.
+
+    Setting ``write_behind`` to True makes ``save()`` queue the object
+    in a buffer of the process, written in the background by batches
+    (see ``WriteBehindBuffer``) instead of right away. Saves are then
+    durable a few milliseconds late and cannot be read back before,
+    and the model cannot have unique attributes. Use ``flush()`` to
+    write the pending objects; they are also written when the process
+    exits.
+
+    Setting ``trust_hash`` to True makes the loading of an object rely
+    on its hash only: an object without any stored attribute is then
+    considered as not existing, which saves the lookup in the ``all``
+    set.
+
+    ``id_block_size`` makes each process reserve the auto-incremented
+    ids by blocks of this size with a single INCRBY, and hand them out
+    without a round trip. The ids of the objects then follow their
+    creation order within a process only, and the ids left in a block
+    when a process exits are never used.
+
+    ``id_generator`` makes the ids generated in the process, without any
+    round trip to Redis, instead of incremented. It is one of
+    ``'snowflake'`` (time-ordered 64-bit integers, see
+    ``SnowflakeGenerator``), ``'ulid'`` (time-ordered strings) or
+    ``'uuid4'``, or a callable returning a new id. The collections of such
+    models are sorted lexicographically by id, so time-ordered ids list
+    the objects in their order of creation.
+
     Example:
 
     >>> from redisco import models
@@ -229,6 +364,7 @@ class ModelBase(type):
         super(ModelBase, cls).__init__(name, bases, attrs)
         global _deferred_refs
         cls._meta = ModelOptions(attrs.pop('Meta', None))
+        _initialize_related(cls, name, bases, attrs)
         deferred = _initialize_references(cls, name, bases, attrs)
         _deferred_refs.extend(deferred)
         _initialize_attributes(cls, name, bases, attrs)
@@ -239,6 +375,9 @@ class ModelBase(type):
         _initialize_key(cls, name)
         _initialize_manager(cls)
         _initialize_auto_increment(cls)
+        _initialize_id_allocator(cls)
+        _initialize_save_engine(cls)
+        _initialize_query_engine(cls)
         # if targeted by a reference field using a string,
         # override for next try
         for target, model_class, att in _deferred_refs:
@@ -249,11 +388,16 @@ class ModelBase(type):
 
 class Model(object):
     __metaclass__ = ModelBase
+    _check_uniques = True
 
     def __init__(self, **kwargs):
         self._modified_attrs = set()
         self._indice_keys = []
         self._zindice_keys = []
+        self._prefetched = {}
+        self._deferred_attrs = set()
+        self._list_snapshots = {}
+        self._stored = False
         self.update_attributes(**kwargs)
 
     def is_valid(self):
@@ -279,13 +423,25 @@ class Model(object):
         .. WARNING::
             You may want to use ``validate`` described below to validate your model
 
+        """
+        return self._is_valid()
+
+    def _is_valid(self, check_uniques=True):
+        """
+        Validates the instance. ``save`` leaves the uniqueness of the
+        values out since it claims them atomically when writing (see
+        ``_claim_uniques``).
         """
         self._errors = []
-        for field in self.fields:
-            try:
-                field.validate(self)
-            except FieldValidationError, e:
-                self._errors.extend(e.errors)
+        self._check_uniques = check_uniques
+        try:
+            for field in self.fields:
+                try:
+                    field.validate(self)
+                except FieldValidationError, e:
+                    self._errors.extend(e.errors)
+        finally:
+            self._check_uniques = True
         self.validate_id()
         self.validate()
         return not bool(self._errors)
@@ -316,7 +472,8 @@ class Model(object):
         The function is here to help you validate your model's id generation policy.
         If not auto incremented and model id not specified by user, it should add error.
         """
-        if not self.auto_increment and self.is_new():
+        if (not self.auto_increment and self._id_generator is None
+                and self.is_new()):
             self._errors.append(('id', 'model id should be specified'))
 
     def update_attributes(self, **kwargs):
@@ -346,6 +503,22 @@ class Model(object):
         2. Assign an ID if the object is new
         3. Save to the datastore.
 
+        A stored instance with nothing to write (see ``is_clean``) is not
+        validated nor written, and no command is sent to Redis.
+
+        The values of the unique attributes are claimed with HSETNX when
+        the object is written, so that two objects can never get the same
+        value. The ``'not unique'`` errors are returned on conflict and
+        nothing is written.
+
+        Within a ``redisco.batch()`` block, the writes are queued into the
+        pipeline of the block, without locking the object. The unique
+        values are still claimed when ``save`` is called. If the block
+        aborts, the instance is restored as it was before ``save``.
+
+        The objects of the models with the ``write_behind`` option are
+        queued into the write-behind buffer of the process.
+
         >>> from redisco import models
         >>> class Foo(models.Model):
         ...    name = models.Attribute()
@@ -356,17 +529,77 @@ class Model(object):
         True
         >>> f.delete()
         """
-        if not self.is_valid():
+        if self.is_clean():
+            self._errors = []
+            return True
+        if not self._is_valid(check_uniques=False):
             return self._errors
         _new = self.is_new()
         if _new:
             self._initialize_id()
-        with Mutex(self):
-            pipeline = self.db.pipeline()
-            self._write(_new, pipeline)
-            pipeline.execute()
+        batch = redisco.get_batch()
+        if batch is not None:
+            state = self._write_state()
+            errors, claimed = self._claim_and_write(_new, batch)
+            if not errors:
+                redisco.on_batch_abort(
+                        lambda: self._abort_write(state, _new, claimed))
+        elif self._write_behind:
+            writebehind.buffer.add(self._changes(_new))
+            errors = []
+        elif self._save_engine == 'script':
+            errors = self._save_script(_new)
+        elif self._save_engine == 'optimistic':
+            errors = self._save_optimistic(_new)
+        else:
+            state, claimed = self._write_state(), []
+            try:
+                with Mutex(self):
+                    pipeline = self.db.pipeline()
+                    errors, claimed = self._claim_and_write(_new, pipeline)
+                    if not errors:
+                        pipeline.execute()
+            except Exception:
+                self._abort_write(state, _new, claimed)
+                raise
+        if errors:
+            if _new:
+                del self._id
+            self._errors.extend(errors)
+            return self._errors
         return True
 
+    def is_clean(self):
+        """
+        Returns True if the instance was loaded from or written to the
+        datastore and has nothing to write: none of its attributes were
+        set and none of its lists changed since, and it has no
+        ``auto_now`` date to refresh. An instance whose id was only given
+        with ``set_id`` is not clean.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...    name = models.Attribute()
+        ...
+        >>> f = Foo(name="Einstein")
+        >>> f.is_clean()
+        False
+        >>> f.save()
+        True
+        >>> f.is_clean()
+        True
+        >>> f.name = "Tesla"
+        >>> f.is_clean()
+        False
+        >>> f.delete()
+        """
+        if not self._stored or self._modified_attrs:
+            return False
+        for att in self.attributes.itervalues():
+            if isinstance(att, (DateTimeField, DateField)) and att.auto_now:
+                return False
+        return not self._list_changes()
+
     def write_to(self, pipeline):
         """
         Write the instance modification to the datastore 
@@ -390,6 +623,7 @@ class Model(object):
         if self.is_new():
             self._errors.append(('id', 'cannot be empty'))
             return self._errors
+        self._add_to_uniques(pipeline)
         self._write(pipeline=pipeline)
         return True
 
@@ -414,13 +648,28 @@ class Model(object):
             return self._key[self.id]
 
     def delete(self):
-        """Deletes the object from the datastore."""
-        pipeline = self.db.pipeline()
+        """
+        Deletes the object from the datastore.
+
+        Within a ``redisco.batch()`` block, the deletion is queued into
+        the pipeline of the block, and the instance forgets its stored
+        index keys if the block aborts. The pending writes of the object in
+        the write-behind buffer are dropped.
+        """
+        if self._write_behind:
+            writebehind.buffer.discard(self.key())
+        batch = redisco.get_batch()
+        pipeline = self.db.pipeline() if batch is None else batch
+        if batch is not None:
+            redisco.on_batch_abort(self._forget_indice_keys)
         self._delete_from_uniques(pipeline)
         self._delete_from_indices(pipeline)
         self._delete_membership(pipeline)
-        pipeline.delete(self.key())
-        pipeline.execute()
+        pipeline.delete(self.key(), *[self.key()[k] for k in self.lists])
+        self._bump_version(pipeline)
+        self._stored = False
+        if batch is None:
+            pipeline.execute()
 
     def is_new(self):
         """
@@ -448,7 +697,10 @@ class Model(object):
         """
         if att not in self.counters:
             raise ValueError("%s is not a counter.")
-        self.db.hincrby(self.key(), att, val)
+        pipeline = self.db.pipeline()
+        pipeline.hincrby(self.key(), att, val)
+        self._bump_version(pipeline)
+        pipeline.execute()
 
     def decr(self, att, val=1):
         """
@@ -527,18 +779,17 @@ class Model(object):
             raise ObjectNotExist 
 
         self._id = str(val)
-        if not self.db.exists(self.key()):
+        pipeline = self.db.pipeline(transaction=False)
+        pipeline.hgetall(self.key())
+        if not self._meta['trust_hash']:
+            pipeline.sismember(self._key['all'], self._id)
+        results = pipeline.execute()
+        if not any(results):
             raise ObjectNotExist
 
-        stored_attrs = self.db.hgetall(self.key())
-        attrs = self.attributes.values()
-        for att in attrs:
-            if att.name in stored_attrs and not isinstance(att, Counter):
-                setattr(self, '_' + att.name, 
-                    att.typecast_for_read(stored_attrs[att.name]))
-
-        self._indice_keys = Set(self.key()['_indices']).members
-        self._zindice_keys = Set(self.key()['_zindices']).members
+        self._set_stored_attrs(results[0])
+        self._indice_keys = None
+        self._zindice_keys = None
 
     @property
     def attributes(self):
@@ -625,23 +876,160 @@ class Model(object):
                     cls._unique_key_for(att), value)
         if id is None:
             return None 
+        if cls._id_generator is not None:
+            return id
         return int(id)
 
     ###################
     # Private methods #
     ###################
 
+    def _set_stored_attrs(self, stored_attrs):
+        """
+        Sets the values of the attributes from the hash ``stored_attrs``
+        as returned by HGETALL, without touching the datastore.
+
+        The sets of index keys the object belongs to are only loaded
+        when a write needs them. See ``_load_indice_keys``.
+        """
+        self._stored = True
+        for att in self.attributes.values():
+            if att.name in stored_attrs and not isinstance(att, Counter):
+                setattr(self, '_' + att.name,
+                    att.typecast_for_read(stored_attrs[att.name]))
+
+    def _load_deferred_attrs(self):
+        """
+        Fetches, with a single HMGET, the attributes that were left out
+        when the object was loaded (see ``ModelSet.only`` and
+        ``ModelSet.defer``) and that have not been set since.
+        """
+        fields = [f for f in self._deferred_attrs
+                  if not hasattr(self, '_' + f)]
+        self._deferred_attrs = set()
+        if not fields:
+            return
+        values = self.db.hmget(self.key(), fields)
+        self._set_stored_attrs(dict((f, v) for f, v in zip(fields, values)
+                                    if v is not None))
+
     def _initialize_id(self):
         """Initializes the id of the instance."""
-        self._id = str(self.db.incr(self._key['id']))
+        self._id = self._allocate_ids(1)[0]
 
-    def _write(self, _new=False, pipeline=None):
-        """Writes the values of the attributes to the datastore.
+    @classmethod
+    def _allocate_ids(cls, n):
+        """
+        Returns ``n`` new auto-incremented ids. See the ``id_block_size``
+        option of ``ModelOptions``.
+        """
+        if cls._id_generator is not None:
+            return [str(cls._id_generator()) for i in xrange(n)]
+        db = redisco.get_client()
+        if cls._id_allocator is not None:
+            return cls._id_allocator.allocate(db, n)
+        if n == 1:
+            return [str(db.incr(cls._key['id']))]
+        last = db.incrby(cls._key['id'], n)
+        return [str(id) for id in xrange(last - n + 1, last + 1)]
+
+    def _save_optimistic(self, _new):
+        """
+        Writes the object in a transaction that WATCHes its hash and its
+        set of indices, and retries it if they were modified by another
+        client before it was executed.
 
-        This method also creates the indices and saves the lists
-        associated to the object.
+        Returns the uniqueness errors (see ``_claim_uniques``), in which
+        case nothing has been written. Raises WatchError when the retries
+        are exhausted, after releasing the claimed unique values.
         """
+        errors, claimed, released = self._claim_uniques(_new)
+        if errors:
+            return errors
+        state = self._write_state()
+        pipeline = self.db.pipeline()
+        for attempt in xrange(self._save_retries):
+            try:
+                pipeline.watch(self.key(), self.key()['_indices'])
+                if not _new:
+                    # the indices may have changed before the WATCH
+                    self._indice_keys = self._zindice_keys = None
+                pipeline.multi()
+                self._release_uniques(released, pipeline)
+                self._write(_new, pipeline)
+                pipeline.execute()
+                return []
+            except WatchError:
+                self._restore_write_state(state)
+            except Exception:
+                self._abort_write(state, _new, claimed)
+                raise
+            finally:
+                pipeline.reset()
+        self._release_uniques(claimed, self.db)
+        raise WatchError("%s was modified by another client %d times." %
+                (self.key(), self._save_retries))
+
+    def _save_script(self, _new):
+        """
+        Writes the object with a single call of the ``SAVE_OBJECT`` Lua
+        script, which also maintains the uniques and the indices on the
+        server side.
+
+        Returns the list of uniqueness errors, in which case nothing
+        has been written.
+        """
+        h, keys_to_be_delete = self._hash_changes(_new)
+        args = [self.id, len(h)]
+        for item in h.iteritems():
+            args.extend(item)
+        args.append(len(keys_to_be_delete))
+        args.extend(keys_to_be_delete)
+        args.append(len(self.uniques))
+        for att in self.uniques:
+            value = self._attribute_value_for_storage(att)
+            args.extend([self._unique_key_for(att), att,
+                         int(value is not None), value or ''])
+        indice_keys, zindices = self._index_entries()
+        args.append(len(indice_keys))
+        args.extend(indice_keys)
+        unloaded = self._unloaded_lists()
+        args.append(len(unloaded))
+        args.extend(self._key[att] + ':' for att in unloaded)
+        args.append(len(zindices))
+        for item in zindices.iteritems():
+            args.extend(item)
+        list_changes = self._list_changes()
+        args.append(len(list_changes))
+        for k, (values, start) in list_changes.iteritems():
+            pushed = values[start or 0:]
+            args.extend([self.key()[k], int(start is not None), len(pushed)]
+                        + pushed)
+
+        conflicts = SAVE_OBJECT(self.db,
+                keys=[self.key(), self._key['all'],
+                      self.key()['_indices'], self.key()['_zindices'],
+                      self._key['_version']],
+                args=args)
+        if conflicts:
+            return [(att, 'not unique') for att in conflicts]
+        # the keys kept for the lists that were not loaded are unknown
+        self._indice_keys = None if unloaded else list(set(indice_keys))
+        self._zindice_keys = zindices.keys()
+        for k, (values, start) in list_changes.iteritems():
+            self._snapshot_list(k, values)
+        self._modified_attrs.clear()
+        self._stored = True
+        return []
+
+    def _hash_changes(self, _new=False):
+        """
+        Returns the mapping of the fields to write in the hash of the
+        object and the list of the fields to delete from it.
 
+        The ``auto_now`` (and ``auto_now_add`` for new objects) dates are
+        set on the way.
+        """
         h = {}
         keys_to_be_delete = []
 
@@ -677,29 +1065,131 @@ class Model(object):
                         h[index] = unicode(v.decode('utf-8'))
                 else:
                     keys_to_be_delete.append(index)
+        return h, keys_to_be_delete
 
-        self._create_membership(pipeline)
-        self._add_to_uniques(pipeline)
-        self._update_indices(pipeline)
-
-        if h:
-            pipeline.hmset(self.key(), h)
-
-        # lists
-        for k, v in self.lists.iteritems():
-            l = List(self.key()[k], pipeline=pipeline)
-            l.clear()
-            values = getattr(self, k)
-            if values:
-                if v._redisco_model:
-                    l.extend([item.id for item in values])
-                else:
-                    l.extend(values)
+    def _list_for_storage(self, att):
+        """
+        Returns the values of the list ``att`` as they are stored.
+        """
+        values = getattr(self, att) or []
+        if self.lists[att]._redisco_model:
+            return [item.id for item in values]
+        return list(values)
+
+    def _list_loaded(self, att):
+        """
+        Returns True if the list ``att`` was read or set on the instance.
+        """
+        return hasattr(self, '_' + att)
 
-        if keys_to_be_delete:
-            pipeline.hdel(self.key(), *keys_to_be_delete)
+    def _unloaded_lists(self):
+        """
+        Returns the indexed lists that were never read or set on a
+        stored object. They are left untouched by the writes.
+        """
+        return [att for att in self.indices
+                if att in self.lists and not self._list_loaded(att)]
 
+    def _snapshot_list(self, att, values):
+        """
+        Records the values of the list ``att`` as they are stored.
+        """
+        self._list_snapshots[att] = [_encode_value(v) for v in values]
+
+    def _list_changes(self):
+        """
+        Returns a mapping of the lists that changed since they were read
+        or written to ``(values, start)``. ``values`` are the values of
+        the list for storage. When ``start`` is None the stored list
+        has to be replaced, otherwise only ``values[start:]`` were
+        appended to it.
+
+        The lists that were never read or set, and those that did not
+        change, are left out.
+        """
+        changes = {}
+        for k in self.lists:
+            if not self._list_loaded(k):
+                continue
+            values = self._list_for_storage(k)
+            stored = self._list_snapshots.get(k)
+            if stored is None:
+                changes[k] = (values, None)
+                continue
+            encoded = [_encode_value(v) for v in values]
+            if encoded == stored:
+                continue
+            if encoded[:len(stored)] == stored:
+                changes[k] = (values, len(stored))
+            else:
+                changes[k] = (values, None)
+        return changes
+
+    def _write(self, _new=False, pipeline=None):
+        """Writes the values of the attributes to the datastore.
+
+        This method also creates the indices and saves the lists
+        associated to the object. The unique values are claimed
+        beforehand, see ``_claim_uniques``.
+        """
+        self._changes(_new).queue(pipeline)
+        self._bump_version(pipeline)
+
+    def _changes(self, _new=False):
+        """
+        Returns the ``ObjectChanges`` to write, and marks the instance as
+        written: it has no modified attributes left, and its lists and
+        index keys are recorded as stored.
+        """
+        changes = ObjectChanges(self)
+        h, keys_to_be_delete = self._hash_changes(_new)
+        changes.hset = h
+        changes.hdel = set(keys_to_be_delete)
+        self._index_changes(changes)
+        for k, (values, start) in self._list_changes().iteritems():
+            changes.lists[self.key()[k]] = (values, start)
+            self._snapshot_list(k, values)
         self._modified_attrs.clear()
+        self._stored = True
+        return changes
+
+    def _write_state(self):
+        """
+        Returns the state of the instance that ``_write`` updates, to
+        restore it with ``_restore_write_state`` if the write is not
+        executed.
+        """
+        return (set(self._modified_attrs), dict(self._list_snapshots),
+                self._stored)
+
+    def _restore_write_state(self, state, _new=False):
+        """
+        Restores the ``state`` taken by ``_write_state`` after the write
+        was dropped, keeping the changes made since. A new object loses
+        its id.
+        """
+        modified_attrs, list_snapshots, stored = state
+        self._modified_attrs.update(modified_attrs)
+        self._list_snapshots = dict(list_snapshots)
+        self._stored = stored
+        self._forget_indice_keys()
+        if _new and not self.is_new():
+            del self._id
+
+    def _forget_indice_keys(self):
+        """
+        Makes the next write fetch the stored index keys of the object.
+        """
+        self._indice_keys = self._zindice_keys = None
+
+    @classmethod
+    def _bump_version(cls, pipeline):
+        """
+        Increments the write version of the model. The temporary keys of
+        the queries are derived from it, so that the results computed
+        before a write are not reused after it.
+        """
+        pipeline.incr(cls._key['_version'])
 
     ##############
     # Membership #
@@ -729,6 +1219,101 @@ class Model(object):
         """
         return cls._key[att]['_uniques']
 
+    def _claim_uniques(self, _new):
+        """
+        Claims, with HSETNX and in a single round trip, the values of the
+        unique attributes of a new object, or the ones that were modified
+        on a stored object.
+
+        Returns a tuple of the ``'not unique'`` errors of the values that
+        are owned by another object, the ``(unique key, value)`` pairs
+        that were claimed, and the ones of the previous values of the
+        object to release once it is written. On conflict the claims
+        are released right away.
+        """
+        pipeline = self.db.pipeline()
+        claims = self._queue_unique_claims(_new, pipeline)
+        if not claims:
+            return [], [], []
+        errors, claimed, released = self._unique_claim_results(
+                _new, claims, iter(pipeline.execute()))
+        if errors:
+            self._release_uniques(claimed, self.db)
+            return errors, [], []
+        return errors, claimed, released
+
+    def _queue_unique_claims(self, _new, pipeline):
+        """
+        Queues into ``pipeline`` the claims of ``_claim_uniques`` and
+        returns the list of the claimed ``(attribute, value)`` pairs, to
+        read the replies with ``_unique_claim_results``.
+        """
+        atts = [att for att in self.uniques
+                if _new or att in self._modified_attrs]
+        claims = [(att, self._attribute_value_for_storage(att))
+                  for att in atts]
+        for att, value in claims:
+            if not _new:
+                pipeline.hget(self.key(), att)
+            if value is not None:
+                pipeline.hsetnx(self._unique_key_for(att), value, self.id)
+                pipeline.hget(self._unique_key_for(att), value)
+        return claims
+
+    def _unique_claim_results(self, _new, claims, results):
+        """
+        Reads the replies of the ``claims`` from the ``results`` iterator
+        and returns the errors, the claimed and the released values (see
+        ``_claim_uniques``), without releasing anything.
+        """
+        errors, claimed, released = [], [], []
+        for att, value in claims:
+            unique = self._unique_key_for(att)
+            old = None if _new else results.next()
+            if value is not None:
+                if results.next():
+                    claimed.append((unique, value))
+                if results.next() != self.id:
+                    errors.append((att, 'not unique'))
+            if old is not None and (value is None or
+                                    old != _encode_value(value)):
+                released.append((unique, old))
+        return errors, claimed, released
+
+    @classmethod
+    def _release_uniques(cls, values, pipeline):
+        """
+        Deletes the ``(unique key, value)`` pairs of ``values`` from the
+        unique hashes.
+        """
+        for unique, value in values:
+            pipeline.hdel(unique, value)
+
+    def _claim_and_write(self, _new, pipeline):
+        """
+        Claims the unique values of the object (see ``_claim_uniques``)
+        and queues its writes into ``pipeline``.
+
+        Returns the uniqueness errors, in which case nothing is queued,
+        and the claimed values, to release with ``_abort_write`` if the
+        pipeline is not executed.
+        """
+        errors, claimed, released = self._claim_uniques(_new)
+        if errors:
+            return errors, []
+        self._release_uniques(released, pipeline)
+        self._write(_new, pipeline)
+        return [], claimed
+
+    def _abort_write(self, state, _new, claimed):
+        """
+        Undoes a write that was queued but not executed: releases the
+        ``claimed`` unique values and restores the ``state`` of the
+        instance (see ``_restore_write_state``).
+        """
+        self._release_uniques(claimed, self.db)
+        self._restore_write_state(state, _new)
+
     def _add_to_uniques(self, pipeline=None):
         """Adds the object to the uniques."""
         for att in self.uniques:
@@ -787,50 +1372,82 @@ class Model(object):
     # INDICES! #
     ############
 
-    def _update_indices(self, pipeline=None):
-        """Updates the indices of the object."""
-        self._delete_from_indices(pipeline)
-        self._add_to_indices(pipeline)
-
-    def _add_to_indices(self, pipeline):
-        """Adds the base64 encoded values of the indices."""
+    def _index_changes(self, changes):
+        """
+        Records into ``changes`` the index keys the object joins or
+        leaves since it was stored, and the scores to update.
+        """
+        self._load_indice_keys()
+        indice_keys, zindices = self._index_entries()
+        old, new = set(self._indice_keys), set(indice_keys)
+        for att in self._unloaded_lists():
+            prefix = self._key[att] + ':'
+            new.update(k for k in old if k.startswith(prefix))
+        changes.left = old - new
+        changes.joined = new - old
+
+        old_zindices = set(self._zindice_keys)
+        changes.zleft = old_zindices - set(zindices)
         for att in self.indices:
-            self._add_to_index(att, pipeline=pipeline)
+            zindex = self._key[att]
+            if zindex not in zindices:
+                continue
+            if zindex not in old_zindices:
+                changes.zjoined.add(zindex)
+            elif zindex[zindices[zindex]] in old:
+                # the score did not change since the object was stored
+                continue
+            changes.scores[zindex] = zindices[zindex]
 
-    def _add_to_index(self, att, val=None, pipeline=None):
-        """
-        Adds the id to the index.
+        self._indice_keys = list(new)
+        self._zindice_keys = zindices.keys()
 
-        This also adds to the _indices set of the object.
+    def _index_entries(self):
+        """
+        Returns the index keys the object should belong to according to
+        its current values, and the mapping of its sorted set indices to
+        their score.
+        """
+        indice_keys, zindices = [], {}
+        unloaded = self._unloaded_lists()
+        for att in self.indices:
+            if att in unloaded:
+                continue
+            index = self._index_key_for(att)
+            if index is None:
+                continue
+            t, index = index
+            if t == 'attribute':
+                indice_keys.append(index)
+            elif t == 'list':
+                indice_keys.extend(index)
+            elif t == 'sortedset':
+                zindex, index = index
+                indice_keys.append(index)
+                descriptor = self.attributes[att]
+                zindices[zindex] = descriptor.typecast_for_storage(
+                        getattr(self, att))
+        return indice_keys, zindices
+
+    def _load_indice_keys(self):
+        """
+        Fetches the index keys of a loaded object from its ``_indices``
+        and ``_zindices`` sets, if they were not fetched yet.
         """
-        index = self._index_key_for(att)
-        if index is None:
+        if self._indice_keys is not None and self._zindice_keys is not None:
             return
-        t, index = index
-        if t == 'attribute':
-            pipeline.sadd(index, self.id)
-            self._indice_keys.append(index)
-            pipeline.sadd(self.key()['_indices'], index)
-        elif t == 'list':
-            for i in index:
-                pipeline.sadd(i, self.id)
-                self._indice_keys.append(i)
-                pipeline.sadd(self.key()['_indices'], i)
-        elif t == 'sortedset':
-            zindex, index = index
-            pipeline.sadd(index, self.id)
-            pipeline.sadd(self.key()['_indices'], index)
-            self._indice_keys.append(index)
-            descriptor = self.attributes[att]
-            score = descriptor.typecast_for_storage(getattr(self, att))
-            pipeline.zadd(zindex, self.id, score)
-            pipeline.sadd(self.key()['_zindices'], zindex)
-            self._zindice_keys.append(zindex)
+        pipeline = self.db.pipeline(transaction=False)
+        pipeline.smembers(self.key()['_indices'])
+        pipeline.smembers(self.key()['_zindices'])
+        indice_keys, zindice_keys = pipeline.execute()
+        self._indice_keys = [k.decode('utf-8') for k in indice_keys]
+        self._zindice_keys = [k.decode('utf-8') for k in zindice_keys]
 
     def _delete_from_indices(self, pipeline):
         """Deletes the object's id from the sets(indices) it has been added
         to and removes its list of indices (used for housekeeping).
         """
+        self._load_indice_keys()
         for index in self._indice_keys:
             pipeline.srem(index, self.id)
         for index in self._zindice_keys:
@@ -923,7 +1540,8 @@ def from_key(key):
         raise BadKeyError
     try:
         _, id = key.split(':', 2)
-        id = int(id)
+        if model._id_generator is None:
+            id = int(id)
     except ValueError, TypeError:
         raise BadKeyError
     return model.objects.get_by_id(id)
@@ -946,12 +1564,14 @@ class Mutex(object):
 
     def lock(self):
         o = self.instance
+        delay = 0.01
         while not o.db.setnx(o.key('_lock'), self.lock_timeout):
             lock = o.db.get(o.key('_lock'))
             if not lock:
                 continue
             if not self.lock_has_expired(lock):
-                time.sleep(0.5)
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
                 continue
             lock = o.db.getset(o.key('_lock'), self.lock_timeout)
             if not lock:
@@ -7,6 +7,7 @@ import unittest
 from datetime import date
 from redisco import models
 from redisco.models.base import Mutex
+from redisco.models import writebehind
 from dateutil.tz import tzlocal
 
 class Person(models.Model):
@@ -153,6 +154,118 @@ class ModelTestCase(RediscoTestCase):
         self.assertTrue(index in db.smembers(key['_indices']))
         self.assertTrue("1" in db.smembers(index))
 
+    def test_lazy_indices(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+
+        p = Person.objects.get_by_id(1)
+        self.assertEqual(None, p._indice_keys)
+        p.first_name = "Morgan"
+        self.assert_(p.save())
+        self.assertEqual(0, self.client.scard('Person:first_name:Granny'))
+        self.assertTrue('1' in self.client.smembers('Person:first_name:Morgan'))
+
+        p = Person.objects.all()[0]
+        self.assertEqual(None, p._indice_keys)
+        p.delete()
+        self.assertEqual(0, self.client.scard('Person:first_name:Morgan'))
+        self.assertFalse(self.client.exists('Person:1:_indices'))
+
+    def test_index_delta(self):
+        class Book(models.Model):
+            title = models.CharField()
+            author = models.CharField()
+            pages = models.IntegerField()
+            rating = models.FloatField()
+            summary = models.Attribute(indexed=False)
+
+        Book.objects.create(title="Dune", author="Herbert", pages=412,
+                rating=4.5, summary="Spice.")
+
+        book = Book.objects.get_by_id(1)
+        book.summary = "Spice must flow."
+        pipeline = self.client.pipeline()
+        book.write_to(pipeline)
+        self.assertEqual(['SADD', 'HMSET', 'INCRBY'],
+                [args[0] for args, options in pipeline.command_stack])
+        pipeline.execute()
+
+        book.title = u"Dune Messiah"
+        book.pages = 256
+        pipeline = self.client.pipeline()
+        book.write_to(pipeline)
+        commands = [args[:2] for args, options in pipeline.command_stack]
+        for command in [('SREM', 'Book:title:Dune'), ('SREM', 'Book:pages:412'),
+                        ('SADD', u'Book:title:Dune Messiah'),
+                        ('SADD', 'Book:pages:256'), ('ZADD', 'Book:pages')]:
+            self.assertTrue(command in commands)
+        self.assertEqual(12, len(commands))
+        pipeline.execute()
+
+        self.assertEqual(set(['Book:title:Dune Messiah', 'Book:author:Herbert',
+                              'Book:pages:256', 'Book:rating:4.500000']),
+                self.client.smembers('Book:1:_indices'))
+        self.assertEqual(0, self.client.scard('Book:title:Dune'))
+        self.assertEqual(256, self.client.zscore('Book:pages', '1'))
+        self.assertEqual(4.5, self.client.zscore('Book:rating', '1'))
+
+    def test_index_delta_counters(self):
+        class Clip(models.Model):
+            name = models.CharField()
+            hits = models.Counter()
+
+        clip = Clip.objects.create(name="intro")
+        clip.incr('hits', 5)
+        clip = Clip.objects.get_by_id(clip.id)
+        clip.name = "outro"
+        self.assertTrue(clip.save())
+        self.assertEqual(5, self.client.zscore('Clip:hits', clip.id))
+        self.assertEqual([clip], list(Clip.objects.filter(hits=5)))
+        self.assertEqual([clip], list(Clip.objects.zfilter(hits__gte=3)))
+
+    def test_clean_save(self):
+        class Book(models.Model):
+            title = models.CharField(unique=True)
+            tags = models.ListField(str)
+            created_at = models.DateTimeField(auto_now_add=True)
+
+        Book.objects.create(title="Dune", tags=['sf'])
+        book = Book.objects.get_by_id(1)
+        self.assertTrue(book.is_clean())
+        self.assertEqual(['sf'], book.tags)
+        self.assertTrue(book.is_clean())
+
+        def commands_processed():
+            return self.client.info()['total_commands_processed']
+        processed = commands_processed()
+        self.assertTrue(book.save())
+        # only the INFO command itself
+        self.assertEqual(processed + 1, commands_processed())
+
+        book.tags.append('classic')
+        self.assertFalse(book.is_clean())
+        self.assertTrue(book.save())
+        self.assertTrue(book.is_clean())
+        self.assertEqual(['sf', 'classic'], Book.objects.get_by_id(1).tags)
+
+        class Post(models.Model):
+            title = models.CharField()
+            updated_at = models.DateTimeField(auto_now=True)
+
+        Post.objects.create(title="Hello")
+        post = Post.objects.get_by_id(1)
+        self.assertFalse(post.is_clean())
+
+        class Draft(models.Model):
+            status = models.Attribute(default="new")
+
+        draft = Draft()
+        draft.set_id(42)
+        self.assertFalse(draft.is_clean())
+        self.assertTrue(draft.save())
+        self.assertTrue(draft.is_clean())
+        self.assertEqual({'status': 'new'}, self.client.hgetall('Draft:42'))
+        self.assertTrue(self.client.sismember('Draft:all', '42'))
+
     def test_delete(self):
         Person.objects.create(first_name="Granny", last_name="Goose")
         Person.objects.create(first_name="Clark", last_name="Kent")
@@ -180,6 +293,234 @@ class ModelTestCase(RediscoTestCase):
 
         self.assertEqual(0, self.client.zcard("Event:created_on"))
 
+    def test_bulk_delete(self):
+        class Session(models.Model):
+            token = models.CharField(unique=True)
+            user = models.CharField()
+            expires = models.IntegerField()
+            pages = models.ListField(str)
+
+        Session.objects.bulk_create([
+                Session(token="t%d" % n, user="u%d" % (n % 3), expires=n,
+                        pages=['/', '/p%d' % n])
+                for n in range(10)])
+
+        expired = Session.objects.filter(user="u1").chunk(2)
+        self.assertEqual(3, expired.delete())
+        self.assertEqual([], self.client.keys('~Session:sort:*'))
+        self.assertEqual(0, len(expired))
+        self.assertEqual(0, expired.delete())
+        self.assertEqual(7, len(Session.objects.all()))
+        self.assertEqual(0, self.client.scard('Session:user:u1'))
+        self.assertEqual(7, self.client.zcard('Session:expires'))
+        self.assertEqual(7, self.client.hlen('Session:token:_uniques'))
+        self.assertEqual(None, Session.objects.get_by_unique(token="t1"))
+        self.assertFalse(self.client.exists('Session:2'))
+        self.assertFalse(self.client.exists('Session:2:_indices'))
+        self.assertFalse(self.client.exists('Session:2:pages'))
+        self.assertEqual(0, self.client.scard('Session:pages:/p1'))
+        self.assertEqual(7, self.client.scard('Session:pages:/'))
+
+        self.assertEqual(2, Session.objects.order('-expires').limit(2, 0).delete())
+        self.assertEqual(None, Session.objects.get_by_unique(token="t9"))
+        self.assertEqual(5, Session.objects.zfilter(expires__gte=0).delete())
+        self.assertEqual([], self.client.keys('Session:*:*'))
+        self.assertEqual(0, self.client.scard('Session:all'))
+        self.assertEqual(0, self.client.zcard('Session:expires'))
+        self.assertEqual(0, self.client.hlen('Session:token:_uniques'))
+
+    def test_bulk_update(self):
+        class Project(models.Model):
+            name = models.CharField(unique=True)
+            status = models.CharField()
+            priority = models.IntegerField()
+            note = models.Attribute(indexed=False)
+            tags = models.ListField(str)
+            visits = models.Counter()
+
+        Project.objects.bulk_create([
+                Project(name="p%d" % n, priority=n % 2, tags=['x'],
+                        status="active" if n < 6 else "archived")
+                for n in range(10)])
+
+        active = Project.objects.filter(status="active").chunk(4)
+        self.assertEqual(6, active.update(status="archived", priority=5,
+                                          note=u"done"))
+        self.assertEqual(0, len(active))
+        self.assertEqual(10, len(Project.objects.filter(status="archived")))
+        self.assertEqual(0, self.client.scard('Project:status:active'))
+        self.assertEqual(6, len(Project.objects.filter(priority=5)))
+        self.assertEqual(6, len(Project.objects.zfilter(priority__gt=1)))
+        self.assertEqual(2, len(Project.objects.filter(priority=1)))
+        project = Project.objects.get_by_id(1)
+        self.assertEqual(5, project.priority)
+        self.assertEqual(u"done", project.note)
+        self.assertEqual(['x'], project.tags)
+        self.assertEqual(set(['Project:status:archived', 'Project:priority:5',
+                              'Project:tags:x', 'Project:visits:0']),
+                self.client.smembers('Project:1:_indices'))
+
+        self.assertEqual(10, Project.objects.all().update(priority=None))
+        self.assertEqual(0, self.client.zcard('Project:priority'))
+        self.assertEqual(set(['Project:visits']),
+                self.client.smembers('Project:1:_zindices'))
+        self.assertEqual(None, Project.objects.get_by_id(1).priority)
+
+        self.assertRaises(ValueError, Project.objects.all().update, name="p")
+        self.assertRaises(ValueError, Project.objects.all().update, tags=[])
+        self.assertRaises(ValueError, Project.objects.all().update, visits=1)
+        self.assertRaises(models.FieldValidationError,
+                          Project.objects.all().update,
+                          priority="high")
+
+    def test_bulk_update_skips_deleted(self):
+        class Project(models.Model):
+            status = models.CharField()
+
+        Project.objects.bulk_create([Project(status="x") for n in range(3)])
+        projects = Project.objects.all()
+        list(projects)
+        Project.objects.get_by_id(2).delete()
+        self.assertEqual(2, projects.update(status="y"))
+        self.assertFalse(self.client.exists('Project:2'))
+        self.assertFalse(self.client.exists('Project:2:_indices'))
+        self.assertEqual(set(['1', '3']),
+                         self.client.smembers('Project:status:y'))
+
+    def test_bulk_update_with_meta_indices(self):
+        class Project(models.Model):
+            status = models.CharField()
+
+            def is_open(self):
+                return self.status == "active"
+
+            class Meta:
+                indices = ['is_open']
+
+        Project.objects.bulk_create([Project(status="active"),
+                                     Project(status="active")])
+        self.assertEqual(1, Project.objects.filter(is_open=True).limit(1)
+                         .update(status="archived"))
+        self.assertEqual(1, len(Project.objects.filter(is_open=True)))
+        self.assertEqual(1, len(Project.objects.filter(is_open=False)))
+
+        projects = Project.objects.all()
+        list(projects)
+        Project.objects.get_by_id(1).delete()
+        self.assertEqual(1, projects.update(status="active"))
+        self.assertFalse(self.client.exists('Project:1'))
+        self.assertEqual(['2'], list(Project.objects.filter(is_open=True)
+                                     .values_list('id', flat=True)))
+
+    def test_unordered(self):
+        for n in range(25):
+            Person.objects.create(first_name="Granny" if n % 5 else "Clark",
+                                  last_name="Goose%d" % n)
+        people = Person.objects.all().unordered().chunk(7)
+        self.assertEqual(25, len(people))
+        self.assertEqual(set(str(n) for n in range(1, 26)),
+                         set(p.id for p in people))
+        self.assertEqual([], self.client.keys('~Person:sort:*'))
+
+        grannies = Person.objects.filter(first_name="Granny").unordered()
+        self.assertEqual(20, len(grannies))
+        self.assertEqual(20, len(list(grannies)))
+        self.assertTrue(Person.objects.get_by_id(2) in grannies)
+        self.assertFalse(Person.objects.get_by_id(1) in grannies)
+        self.assertEqual(None, grannies.get_by_id(1))
+        self.assertEqual([], self.client.keys('~Person:sort:*'))
+        clarks = Person.objects.exclude(first_name="Granny").unordered()
+        self.assertEqual(['Goose0', 'Goose10'],
+                         sorted(clarks.values_list('last_name', flat=True))[:2])
+
+        ordered = Person.objects.all().unordered().order('last_name').limit(2)
+        self.assertEqual(['Goose0', 'Goose1'], [p.last_name for p in ordered])
+
+    def test_shared_query_results(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+
+        def grannies():
+            return Person.objects.filter(first_name="Granny").order('last_name')
+        self.assertEqual(['Goose', 'Mommy'], [p.last_name for p in grannies()])
+        keys = set(self.client.keys('~Person:*'))
+        self.assertEqual(2, len(keys))
+        self.assertEqual(['Goose', 'Mommy'], [p.last_name for p in grannies()])
+        self.assertEqual(keys, set(self.client.keys('~Person:*')))
+
+        calls = []
+        execute = self.client.execute_command
+        def execute_command(*args, **options):
+            calls.append(args[0])
+            return execute(*args, **options)
+        self.client.execute_command = execute_command
+        try:
+            self.assertEqual(['Goose', 'Mommy'],
+                             [p.last_name for p in grannies()])
+        finally:
+            del self.client.execute_command
+        self.assertEqual(['GET', 'EXPIRE', 'EXPIRE'], calls[:3])
+        self.assertFalse('SORT' in calls or 'EXPIRE' in calls[3:])
+
+        Person.objects.create(first_name="Granny", last_name="Kent")
+        self.assertEqual(['Goose', 'Kent', 'Mommy'],
+                         [p.last_name for p in grannies()])
+        self.assertEqual(4, len(self.client.keys('~Person:*')))
+
+        self.assertEqual(['Goose', 'Mommy'], [p.last_name for p in
+                Person.objects.filter(first_name="Granny").exclude(last_name="Kent")])
+        self.assertEqual(['Goose', 'Mommy'], [p.last_name for p in
+                Person.objects.exclude(last_name="Kent").filter(first_name="Granny")])
+        self.assertEqual(['Clark', 'Granny'], [p.first_name for p in
+                Person.objects.exclude(last_name="Goose").limit(2)])
+
+    def test_batch(self):
+        clark = Person.objects.create(first_name="Clark", last_name="Kent")
+        with redisco.batch():
+            granny = Person(first_name="Granny", last_name="Goose")
+            self.assertTrue(granny.save())
+            clark.first_name = "Superman"
+            self.assertTrue(clark.save())
+            with redisco.batch():
+                Person(first_name="Lois", last_name="Lane").save()
+            self.assertEqual(['Person:1'], self.client.keys('Person:[0-9]'))
+            self.assertEqual(0, len(Person.objects.filter(first_name="Superman")))
+        self.assertEqual(3, len(Person.objects.all()))
+        self.assertEqual(clark, Person.objects.filter(first_name="Superman").first())
+        self.assertEqual(granny, Person.objects.filter(first_name="Granny").first())
+        self.assertEqual(None, redisco.get_batch())
+
+        with redisco.batch():
+            clark.delete()
+            self.assertEqual(3, len(Person.objects.all()))
+        self.assertEqual(2, len(Person.objects.all()))
+        self.assertFalse(self.client.exists(clark.key()))
+
+        def fail():
+            with redisco.batch():
+                granny.delete()
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(None, redisco.get_batch())
+        self.assertEqual(granny, Person.objects.filter(first_name="Granny").first())
+
+        def abort():
+            with redisco.batch():
+                granny.first_name = "Nanny"
+                self.assertTrue(granny.save())
+                lois.last_name = "Kent"
+                self.assertTrue(lois.save())
+                raise ValueError
+        lois = Person(first_name="Lois", last_name="Lane")
+        self.assertRaises(ValueError, abort)
+        self.assertFalse(granny.is_clean())
+        self.assertTrue(lois.is_new())
+        self.assertTrue(granny.save())
+        self.assertTrue(lois.save())
+        self.assertEqual(granny, Person.objects.filter(first_name="Nanny").first())
+        self.assertEqual(lois, Person.objects.filter(last_name="Kent").first())
+
     def test_filter(self):
         Person.objects.create(first_name="Granny", last_name="Goose")
         Person.objects.create(first_name="Clark", last_name="Kent")
@@ -327,6 +668,60 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual([9, 33, 75, 95, 99,], [exam.score for exam in exams])
         filtered = Exam.objects.zfilter(score__in=(10, 96))
         self.assertEqual(3, len(filtered))
+        self.assertEqual([33, 75, 95], sorted(e.score for e in
+                                              filtered.get_many(range(1, 6))))
+        self.assertEqual(2, len(filtered.get_many([1, 2, 3, 4])))
+
+    def test_combined_zfilters(self):
+        class Flat(models.Model):
+            city = models.CharField()
+            rooms = models.IntegerField()
+            rent = models.FloatField()
+
+        Flat.objects.create(city="Paris", rooms=3, rent=1500.0)
+        Flat.objects.create(city="Paris", rooms=1, rent=700.0)
+        Flat.objects.create(city="Lyon", rooms=4, rent=1100.0)
+        Flat.objects.create(city="Paris", rooms=2, rent=1200.0)
+        Flat.objects.create(city="Paris", rooms=5, rent=900.0)
+
+        def rooms(flats):
+            return [f.rooms for f in flats]
+        paris = Flat.objects.filter(city="Paris")
+        self.assertEqual([1, 2, 3, 5], rooms(paris.zfilter(rooms__gte=1)))
+        self.assertEqual([2, 5], rooms(paris.zfilter(rooms__gt=1)
+                                            .zfilter(rent__lt=1500)))
+        self.assertEqual([5, 2], rooms(paris.zfilter(rent__lte=1200)
+                                            .zfilter(rooms__in=(2, 5))))
+        self.assertEqual([2], rooms(paris.zfilter(rooms__gt=1)
+                                         .zfilter(rent__gt=900).limit(1, 0)))
+        self.assertEqual([5, 2], rooms(paris.zfilter(rooms__gt=1, rent__lt=1500)
+                                            .order('-rooms')))
+        self.assertEqual([4], rooms(Flat.objects.exclude(city="Paris")
+                                                .zfilter(rooms__gte=1)))
+        self.assertEqual(2, len(paris.zfilter(rent__in=(900, 1200))))
+        self.assertEqual([4, 5], rooms(Flat.objects.zfilter(rooms__gt=1)
+                                                   .zfilter(rent__lt=1200)))
+        self.client.delete(*self.client.keys('~Flat:*'))
+        self.assertEqual([2, 3], rooms(Flat.objects.zfilter(rooms__gte=2)
+                                                   .limit(2, 0)))
+        self.assertEqual([], self.client.keys('~Flat:*'))
+        self.assertRaises(ValueError, list, paris.zfilter(rooms__eq=2))
+
+    def test_lone_zfilter_members(self):
+        class Flat(models.Model):
+            rooms = models.IntegerField()
+
+        Flat.objects.bulk_create([Flat(rooms=n % 4) for n in range(20)])
+        big = Flat.objects.zfilter(rooms__gt=1)
+        self.assertEqual(['3', '4'], [f.id for f in big.get_many([2, 3, 4])])
+        self.assertEqual(None, big.get_by_id(2))
+        self.assertEqual('4', big.get_by_id(4).id)
+        self.assertEqual([], self.client.keys('~Flat:*'))
+        self.assertEqual(10, big.chunk(3).delete())
+        self.assertEqual([], self.client.keys('~Flat:*'))
+        self.assertEqual(10, len(Flat.objects.all()))
+        self.assertEqual(set([0, 1]),
+                         set(f.rooms for f in Flat.objects.all()))
 
 
     def test_filter_date(self):
@@ -530,6 +925,134 @@ class ModelTestCase(RediscoTestCase):
         self.assertEqual(Person.objects.get_by_id('3'), a[0])
         self.assertEqual("Martha Kent", a[3].full_name())
 
+    def test_chunked_iteration(self):
+        for name in ("Granny", "Clark", "Lois", "Lex", "Lionel"):
+            Person.objects.create(first_name=name, last_name="Kent")
+
+        persons = Person.objects.all().chunk(2)
+        self.assertEqual([Person.objects.get_by_id(i) for i in range(1, 6)],
+                list(persons))
+        self.assertEqual(["Clark", "Lois", "Lex"],
+                [p.first_name for p in persons[1:4]])
+
+        for person in Person.objects.filter(last_name="Kent").chunk(3):
+            person.delete()
+        self.assertEqual(0, self.client.scard('Person:all'))
+        self.assertEqual(0, self.client.scard('Person:last_name:Kent'))
+
+    def test_get_many(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Lois", last_name="Kent")
+
+        persons = Person.objects.get_many([3, '1', 42])
+        self.assertEqual(["Lois", "Granny"], [p.first_name for p in persons])
+
+        persons = Person.objects.filter(last_name="Kent").get_many([1, 2, 3])
+        self.assertEqual(['2', '3'], [p.id for p in persons])
+        self.assertEqual([], self.client.keys('~Person:sort:*'))
+        self.assertEqual(None, Person.objects.exclude(last_name="Kent")
+                                             .get_by_id(2))
+        self.assertEqual(['1'], [p.id for p in Person.objects.exclude(
+                last_name="Kent").limit(2).get_many([1, 2])])
+
+        persons = Person.objects.in_bulk([1, 2, 42])
+        self.assertEqual(['1', '2'], sorted(persons.keys()))
+        self.assertEqual("Clark", persons['2'].first_name)
+
+    def test_get_by_id_existence(self):
+        class Tag(models.Model):
+            name = models.CharField()
+
+        class TrustedTag(models.Model):
+            name = models.CharField()
+
+            class Meta:
+                trust_hash = True
+
+        assert Tag.objects.create()
+        assert TrustedTag.objects.create()
+        assert TrustedTag.objects.create(name="redis")
+
+        self.assert_(Tag.objects.get_by_id(1))
+        self.assertEqual(None, Tag.objects.get_by_id(2))
+        self.assertEqual(None, TrustedTag.objects.get_by_id(1))
+        self.assertEqual("redis", TrustedTag.objects.get_by_id(2).name)
+
+    def test_only_and_defer(self):
+        class Article(models.Model):
+            title = models.CharField()
+            body = models.Attribute(indexed=False)
+            views = models.IntegerField()
+
+        Article.objects.create(title="Redis", body="In memory.", views=3)
+        Article.objects.create(title="Lua", body="Scripting.", views=1)
+
+        articles = list(Article.objects.all().only('title'))
+        self.assertEqual(set(['body', 'views']), articles[0]._deferred_attrs)
+        self.assertFalse(hasattr(articles[0], '_body'))
+        self.assertEqual("Redis", articles[0].title)
+        self.assertEqual("In memory.", articles[0].body)
+        self.assertEqual(3, articles[0].views)
+        self.assertEqual(set(), articles[0]._deferred_attrs)
+
+        lua = Article.objects.all().defer('body').get_by_id(2)
+        self.assertEqual(set(['body']), lua._deferred_attrs)
+        self.assertEqual(1, lua.views)
+        lua.body = "Scripting in Redis."
+        lua.views = 2
+        assert lua.save()
+        lua = Article.objects.get_by_id(2)
+        self.assertEqual("Scripting in Redis.", lua.body)
+        self.assertEqual(2, lua.views)
+        self.assertEqual("Lua", lua.title)
+
+        self.assertEqual(None, Article.objects.all().only().get_by_id(3))
+        self.assertRaises(ValueError, Article.objects.all().only, 'author')
+
+    def test_values(self):
+        class Article(models.Model):
+            title = models.CharField()
+            views = models.IntegerField()
+            likes = models.Counter()
+
+        Article.objects.create(title="Redis", views=3)
+        lua = Article.objects.create(title="Lua")
+        lua.incr('likes', 2)
+
+        self.assertEqual([{'id': '1', 'title': "Redis", 'views': 3, 'likes': 0},
+                          {'id': '2', 'title': "Lua", 'views': None, 'likes': 2}],
+                list(Article.objects.all().values()))
+        self.assertEqual([("Lua", '2')],
+                list(Article.objects.filter(title="Lua")
+                    .values_list('title', 'id')))
+        self.assertEqual([3, None],
+                list(Article.objects.all().chunk(1)
+                    .values_list('views', flat=True)))
+        self.assertRaises(TypeError, Article.objects.all().values_list,
+                'title', 'views', flat=True)
+        self.assertRaises(ValueError, Article.objects.all().values, 'author')
+
+    def test_bulk_create(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        persons = [Person(first_name="Clark", last_name="Kent"),
+                   Person(first_name="Lois", last_name="Kent"),
+                   Person(first_name="Lex", last_name="Luthor")]
+
+        self.assertEqual(persons,
+                Person.objects.bulk_create(persons, batch_size=2))
+        self.assertEqual(['2', '3', '4'], [p.id for p in persons])
+        self.assertEqual("4", self.client.get('Person:id'))
+        self.assertEqual(2, len(Person.objects.filter(last_name="Kent")))
+        self.assertEqual("Lex Luthor", Person.objects.get_by_id(4).full_name())
+        self.assertEqual("Lois Kent",
+                Person.objects.filter(full_name="Lois Kent").first().full_name())
+
+        self.assertRaises(models.FieldValidationError,
+                Person.objects.bulk_create, [Person(first_name="Jimmy"),
+                                             Person(first_name="J" * 256)])
+        self.assertEqual(4, len(Person.objects.all()))
+
     def test_get_or_create(self):
         Person.objects.create(first_name="Granny", last_name="Goose")
         Person.objects.create(first_name="Clark", last_name="Kent")
@@ -594,6 +1117,92 @@ class UniqueAttributeTestCase(RediscoTestCase):
         self.assertEqual(employee.name, emp.name)
         self.assertEqual(employee.email, emp.email)
 
+    def test_bulk_create_uniques(self):
+        Employee.objects.create(name='Clark Kent', email='clark@dailyplanet.com')
+        employees = [Employee(name='Lois Lane', email='lois@dailyplanet.com'),
+                     Employee(name='Clark Kent', email='kent@dailyplanet.com'),
+                     Employee(name='Jimmy Olsen', email='lois@dailyplanet.com')]
+
+        self.assertRaises(models.FieldValidationError,
+                Employee.objects.bulk_create, employees)
+        self.assertEqual([], employees[0].errors)
+        self.assertEqual([('name', 'not unique')], employees[1].errors)
+        self.assertEqual([('email', 'not unique')], employees[2].errors)
+        self.assertEqual(1, len(Employee.objects.all()))
+        self.assertEqual(['clark@dailyplanet.com'],
+                         self.client.hkeys('Employee:email:_uniques'))
+        self.assertTrue(all(e.is_new() for e in employees))
+
+        # a value claimed by another client is never taken over
+        self.client.hset('Employee:name:_uniques', 'Perry White', '99')
+        perry = Employee(name='Perry White')
+        self.assertRaises(models.FieldValidationError,
+                Employee.objects.bulk_create, [perry], batch_size=1)
+        self.assertEqual('99', self.client.hget('Employee:name:_uniques',
+                                                'Perry White'))
+        employees = Employee.objects.bulk_create(employees[:1] +
+                [Employee(name='Jimmy Olsen', email='jimmy@dailyplanet.com')])
+        self.assertEqual([e.id for e in employees],
+                self.client.hmget('Employee:email:_uniques',
+                    ['lois@dailyplanet.com', 'jimmy@dailyplanet.com']))
+
+    def test_uniques_claimed_on_save(self):
+        clark = Employee(name='Clark Kent', email='clark@dailyplanet.com')
+        lois = Employee(name='Clark Kent', email='lois@dailyplanet.com')
+        self.assertTrue(clark.is_valid())
+        self.assertTrue(lois.is_valid())
+        self.assertTrue(clark.save())
+        self.assertEqual([('name', 'not unique')], lois.save())
+        self.assertTrue(lois.is_new())
+        self.assertFalse(self.client.hexists('Employee:email:_uniques',
+                                             'lois@dailyplanet.com'))
+        self.assertEqual(1, len(Employee.objects.all()))
+
+        clark.name = 'Superman'
+        self.assertTrue(clark.save())
+        self.assertFalse(self.client.hexists('Employee:name:_uniques',
+                                             'Clark Kent'))
+        self.assertTrue(lois.save())
+        self.assertEqual(lois.id, self.client.hget('Employee:name:_uniques',
+                                                   'Clark Kent'))
+
+        lois.email = 'clark@dailyplanet.com'
+        self.assertEqual([('email', 'not unique')], lois.save())
+        self.assertEqual('lois@dailyplanet.com',
+                         Employee.objects.get_by_id(lois.id).email)
+        self.assertEqual(clark.id, self.client.hget('Employee:email:_uniques',
+                                                    'clark@dailyplanet.com'))
+        self.assertEqual(lois.id, self.client.hget('Employee:email:_uniques',
+                                                   'lois@dailyplanet.com'))
+
+    def test_uniques_released_on_abort(self):
+        def abort():
+            with redisco.batch():
+                Employee(name='Jimmy Olsen', email='jimmy@dailyplanet.com').save()
+                raise ValueError
+        self.assertRaises(ValueError, abort)
+        self.assertEqual({}, self.client.hgetall('Employee:email:_uniques'))
+        jimmy = Employee(name='Jimmy Olsen', email='jimmy@dailyplanet.com')
+        self.assertTrue(jimmy.save())
+
+        class Intern(models.Model):
+            name = models.Attribute(unique=True)
+
+            def _write(self, _new=False, pipeline=None):
+                super(Intern, self)._write(_new, pipeline)
+                if self.name == 'Broken':
+                    pipeline.execute_command('NOSUCHCOMMAND')
+
+        intern = Intern(name='Broken')
+        self.assertRaises(redis.ResponseError, intern.save)
+        self.assertTrue(intern.is_new())
+        self.assertFalse(self.client.exists('Intern:name:_uniques'))
+        intern.name = 'Fixed'
+        self.assertTrue(intern.save())
+        self.assertEqual({'Fixed': intern.id},
+                         self.client.hgetall('Intern:name:_uniques'))
+
+
 class Event(models.Model):
     name = models.CharField(required=True)
     date = models.DateField(required=True)
@@ -760,6 +1369,48 @@ class ListFieldTestCase(RediscoTestCase):
         self.assertEqual([], cake.sizes)
         self.assertEqual([], cake.ingredients)
 
+    def test_unchanged_lists_are_not_rewritten(self):
+        class Cake(models.Model):
+            name = models.CharField()
+            ingredients = models.ListField(str)
+            sizes = models.ListField(int)
+
+        Cake.objects.create(name="StrCake",
+                            ingredients=['strawberry', 'sugar'],
+                            sizes=[1, 2])
+        cake = Cake.objects.get_by_id(1)
+        list_keys = (cake.key()['ingredients'], cake.key()['sizes'])
+
+        def list_commands(cake):
+            pipeline = self.client.pipeline()
+            cake.write_to(pipeline)
+            commands = [args[:3] for args, options in pipeline.command_stack
+                        if args[1] in list_keys]
+            pipeline.execute()
+            return commands
+
+        cake.name = "Strawberry Cake"
+        self.assertEqual([], list_commands(cake))
+        self.assertEqual([1, 2], cake.sizes)
+        self.assertEqual([], list_commands(cake))
+
+        cake.sizes.append(5)
+        self.assertEqual([('RPUSH', list_keys[1], 5)], list_commands(cake))
+        self.assertEqual([], list_commands(cake))
+
+        cake.ingredients.remove('strawberry')
+        self.assertEqual([('DEL', list_keys[0]),
+                          ('RPUSH', list_keys[0], 'sugar')],
+                         list_commands(cake))
+
+        cake = Cake.objects.get_by_id(1)
+        self.assertEqual("Strawberry Cake", cake.name)
+        self.assertEqual(['sugar'], cake.ingredients)
+        self.assertEqual([1, 2, 5], cake.sizes)
+        self.assertEqual(1, len(Cake.objects.filter(sizes=2)))
+        self.assertEqual(0, len(Cake.objects.filter(ingredients='strawberry')))
+        self.assertEqual(1, len(Cake.objects.filter(ingredients='sugar')))
+
     def test_list_of_reference_fields(self):
         class Book(models.Model):
             title = models.CharField(required=True)
@@ -796,6 +1447,13 @@ class ListFieldTestCase(RediscoTestCase):
         author1 = Author.objects.get_by_id(1)
         self.assertEqual(2, len(author1.books))
 
+        first = author1.books[0]
+        author1.books = [book, first, book]
+        assert author1.save()
+        first.delete()
+        author1 = Author.objects.get_by_id(1)
+        self.assertEqual([book, book], author1.books)
+
     def test_lazy_reference_field(self):
         class User(models.Model):
             name = models.CharField()
@@ -899,6 +1557,54 @@ class ReferenceFieldTestCase(RediscoTestCase):
         self.assertEqual("1.3.18", u.address.zipcode)
 
 
+    def test_select_related(self):
+        class Author(models.Model):
+            name = models.CharField()
+
+        class Book(models.Model):
+            title = models.CharField()
+            author = models.ReferenceField(Author)
+
+        tolkien = Author.objects.create(name="Tolkien")
+        lewis = Author.objects.create(name="Lewis")
+        Book.objects.create(title="The Hobbit", author=tolkien)
+        Book.objects.create(title="Narnia", author=lewis)
+        Book.objects.create(title="Anonymous")
+
+        books = list(Book.objects.all().select_related('author'))
+        self.client.delete(tolkien.key(), lewis.key())
+        self.assertEqual("Tolkien", books[0].author.name)
+        self.assertEqual("Lewis", books[1].author.name)
+        self.assertEqual(None, books[2].author)
+        self.assertRaises(ValueError, Book.objects.all().select_related,
+                'title')
+
+    def test_prefetch_related(self):
+        class Author(models.Model):
+            name = models.CharField()
+
+        class Book(models.Model):
+            title = models.CharField()
+            author = models.ReferenceField(Author, related_name='books')
+
+        tolkien = Author.objects.create(name="Tolkien")
+        lewis = Author.objects.create(name="Lewis")
+        Author.objects.create(name="Nobody")
+        hobbit = Book.objects.create(title="The Hobbit", author=tolkien)
+        narnia = Book.objects.create(title="Narnia", author=lewis)
+        lotr = Book.objects.create(title="The Lord of the Rings",
+                author=tolkien)
+
+        authors = list(Author.objects.all().prefetch_related('books'))
+        self.client.delete(hobbit.key(), narnia.key(), lotr.key())
+        self.assertEqual([hobbit, lotr], list(authors[0].books))
+        self.assertEqual(2, len(authors[0].books))
+        self.assertEqual(narnia, authors[1].books[0])
+        self.assertEqual([], list(authors[2].books))
+        self.assertRaises(ValueError, Author.objects.all().prefetch_related,
+                'book_set')
+
+
 class DateTimeFieldTestCase(RediscoTestCase):
 
     def test_basic(self):
@@ -971,6 +1677,225 @@ class AutoIncrementTestCase(RediscoTestCase):
         self.assertTrue(student.is_valid())
 
 
+class IdAllocationTestCase(RediscoTestCase):
+
+    def test_id_blocks(self):
+        class Student(models.Model):
+            name = models.CharField()
+
+            class Meta:
+                id_block_size = 10
+
+        students = [Student.objects.create(name="s%d" % n) for n in range(3)]
+        self.assertEqual(['1', '2', '3'], [s.id for s in students])
+        self.assertEqual('10', self.client.get('Student:id'))
+
+        students = Student.objects.bulk_create(
+                [Student(name="b%d" % n) for n in range(12)])
+        self.assertEqual([str(n) for n in range(4, 16)],
+                         [s.id for s in students])
+        self.assertEqual('20', self.client.get('Student:id'))
+        self.assertEqual(15, len(Student.objects.all()))
+
+        # a forked process reserves its own block
+        Student._id_allocator._pid = None
+        self.assertEqual('21', Student.objects.create(name="f").id)
+
+    def test_id_blocks_threads(self):
+        class Student(models.Model):
+            class Meta:
+                id_block_size = 7
+
+        ids = []
+        def create():
+            for n in range(20):
+                ids.append(Student.objects.create().id)
+        threads = [Thread(target=create) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(str(n) for n in range(1, 81)), sorted(ids))
+
+
+    def test_id_generators(self):
+        lengths = {'snowflake': 19, 'ulid': 26, 'uuid4': 36}
+        for generator in ('snowflake', 'ulid', 'uuid4'):
+            class Student(models.Model):
+                name = models.CharField()
+                email = models.CharField(unique=True)
+
+                class Meta:
+                    id_generator = generator
+
+            students = []
+            for n in range(5):
+                students.append(Student.objects.create(
+                        name="s%d" % (n % 2), email="s%d@example.com" % n))
+                time.sleep(0.002)
+            self.assertEqual(5, len(set(s.id for s in students)))
+            self.assertEqual(lengths[generator], len(students[0].id))
+            self.assertFalse(self.client.exists('Student:id'))
+            if generator != 'uuid4':
+                self.assertEqual(students, list(Student.objects.all()))
+            self.assertEqual(set(students[::2]),
+                             set(Student.objects.filter(name="s0")))
+            self.assertEqual(students[1], Student.objects.get_by_id(students[1].id))
+            self.assertEqual(students[3],
+                    Student.objects.get_by_unique(email="s3@example.com"))
+            self.assertEqual(2, Student.objects.filter(name="s1").delete())
+            self.client.flushdb()
+
+        class Worker(models.Model):
+            class Meta:
+                id_generator = models.SnowflakeGenerator(worker_id=5)
+        worker = Worker.objects.create()
+        self.assertEqual(5, (int(worker.id) >> 12) & 0x3ff)
+
+        # the processes reserve distinct worker ids
+        first, second = models.SnowflakeGenerator(), models.SnowflakeGenerator()
+        workers = [(int(g()) >> 12) & 0x3ff for g in (first, second, first)]
+        self.assertEqual(workers[0], workers[2])
+        self.assertNotEqual(workers[0], workers[1])
+        self.assertEqual('2', self.client.get('redisco:snowflake:worker'))
+
+        class Ticket(models.Model):
+            class Meta:
+                id_generator = lambda: "T-%d" % len(tickets)
+        tickets = []
+        tickets.append(Ticket.objects.create())
+        self.assertEqual("T-0", tickets[0].id)
+        self.assertEqual(tickets, list(Ticket.objects.all()))
+        self.assertEqual(tickets[0], models.from_key("Ticket:T-0"))
+
+        def unknown():
+            class Badge(models.Model):
+                class Meta:
+                    id_generator = 'random'
+        self.assertRaises(ValueError, unknown)
+
+
+class WriteBehindTestCase(RediscoTestCase):
+
+    def setUp(self):
+        super(WriteBehindTestCase, self).setUp()
+        self.interval = redisco.write_behind_interval
+        self.size = redisco.write_behind_size
+        redisco.write_behind_interval = 60
+
+        class Reading(models.Model):
+            sensor = models.CharField()
+            value = models.IntegerField()
+            tags = models.ListField(str)
+
+            class Meta:
+                write_behind = True
+
+        self.Reading = Reading
+
+    def tearDown(self):
+        models.flush()
+        redisco.write_behind_interval = self.interval
+        redisco.write_behind_size = self.size
+        super(WriteBehindTestCase, self).tearDown()
+
+    def test_flush(self):
+        reading = self.Reading(sensor="t1", value=20)
+        self.assertTrue(reading.save())
+        reading.value = 21
+        self.assertTrue(reading.save())
+        other = self.Reading.objects.create(sensor="t2", value=3)
+        self.assertEqual(0, len(self.Reading.objects.all()))
+        self.assertEqual([reading.key(), other.key()],
+                         writebehind.buffer._pending.keys())
+
+        models.flush()
+        self.assertEqual(21, self.Reading.objects.get_by_id(reading.id).value)
+        self.assertEqual(1, len(self.Reading.objects.filter(value=21)))
+        self.assertEqual(0, len(self.Reading.objects.filter(value=20)))
+        self.assertTrue(reading.save())
+        self.assertEqual([], writebehind.buffer._pending.keys())
+
+    def test_changes_taken_on_save(self):
+        reading = self.Reading(sensor="t1", value=20, tags=['a'])
+        self.assertTrue(reading.save())
+        reading.sensor = "unsaved"
+        reading.tags.append('b')
+        self.assertTrue(reading.save())
+        reading.tags.append('c')
+        reading.value = 30
+        models.flush()
+        self.assertEqual(set(['value']), reading._modified_attrs)
+        stored = self.Reading.objects.get_by_id(reading.id)
+        self.assertEqual("unsaved", stored.sensor)
+        self.assertEqual(20, stored.value)
+        self.assertEqual(['a', 'b'], stored.tags)
+        self.assertEqual(1, len(self.Reading.objects.filter(tags='b')))
+        self.assertTrue(reading.save())
+        models.flush()
+        stored = self.Reading.objects.get_by_id(reading.id)
+        self.assertEqual(30, stored.value)
+        self.assertEqual(['a', 'b', 'c'], stored.tags)
+        self.assertEqual(0, len(self.Reading.objects.filter(value=20)))
+        self.assertEqual(1, len(self.Reading.objects.zfilter(value__gt=25)))
+
+    def test_flush_on_size(self):
+        redisco.write_behind_size = 3
+        for n in range(3):
+            self.Reading.objects.create(sensor="t%d" % n, value=n)
+        for i in range(100):
+            if len(self.Reading.objects.all()) == 3:
+                break
+            time.sleep(0.01)
+        self.assertEqual(3, len(self.Reading.objects.all()))
+
+    def test_delete_pending(self):
+        reading = self.Reading.objects.create(sensor="t1", value=20)
+        models.flush()
+        reading.value = 30
+        reading.save()
+        reading.delete()
+        models.flush()
+        self.assertEqual(0, len(self.Reading.objects.all()))
+        self.assertFalse(self.client.exists(reading.key()))
+
+        readings = [self.Reading.objects.create(sensor="t2", value=n)
+                    for n in range(3)]
+        models.flush()
+        readings[0].value = 10
+        readings[0].save()
+        self.Reading.objects.create(sensor="t2", value=4)
+        self.assertEqual(4, self.Reading.objects.filter(sensor="t2").delete())
+        models.flush()
+        self.assertEqual(0, len(self.Reading.objects.all()))
+        self.assertEqual([], self.client.keys('Reading:[0-9]*'))
+
+    def test_flush_at_exit(self):
+        buffer, writebehind.buffer = (writebehind.buffer,
+                                      writebehind.WriteBehindBuffer())
+        try:
+            reading = self.Reading.objects.create(sensor="t1", value=20)
+            thread = writebehind.buffer._thread
+            writebehind.buffer._flush_at_exit()
+            self.assertFalse(thread.is_alive())
+            self.assertEqual(1, len(self.Reading.objects.all()))
+            reading.value = 30
+            reading.save()
+            self.assertTrue(writebehind.buffer._thread is thread)
+            self.assertEqual(30, self.Reading.objects.get_by_id(1).value)
+        finally:
+            writebehind.buffer = buffer
+
+    def test_no_uniques(self):
+        def define():
+            class Sensor(models.Model):
+                name = models.CharField(unique=True)
+
+                class Meta:
+                    write_behind = True
+        self.assertRaises(ValueError, define)
+
+
 class MutexTestCase(RediscoTestCase):
 
     def setUp(self):
@@ -1003,3 +1928,220 @@ class MutexTestCase(RediscoTestCase):
         Mutex(self.p1).lock()
         with Mutex(self.p2):
             self.assert_(True)
+
+
+class OptimisticSaveTestCase(RediscoTestCase):
+
+    def test_save(self):
+        class Book(models.Model):
+            title = models.CharField()
+
+            class Meta:
+                save_engine = 'optimistic'
+
+        book = Book.objects.create(title="Dune")
+        book = Book.objects.get_by_id(book.id)
+        book.title = "Dune Messiah"
+        self.assert_(book.save())
+        self.assertEqual(0, self.client.scard('Book:title:Dune'))
+        self.assertEqual("Dune Messiah", Book.objects.get_by_id(1).title)
+
+    def test_unique_conflict(self):
+        class Book(models.Model):
+            isbn = models.CharField(unique=True)
+
+            class Meta:
+                save_engine = 'optimistic'
+
+        Book.objects.create(isbn="0441013597")
+        book = Book(isbn="0441013597")
+        self.assertEqual([('isbn', 'not unique')], book.save())
+        self.assertTrue(book.is_new())
+        self.assertEqual(1, len(Book.objects.all()))
+
+    def test_retry_on_concurrent_write(self):
+        class Book(models.Model):
+            title = models.CharField()
+            concurrent_titles = []
+            writes = []
+
+            def _write(self, _new=False, pipeline=None):
+                self.writes.append(self.title)
+                if self.concurrent_titles:
+                    other = Book.objects.get_by_id(self.id)
+                    other.title = self.concurrent_titles.pop()
+                    other.save()
+                super(Book, self)._write(_new, pipeline)
+
+            class Meta:
+                save_engine = 'optimistic'
+
+        book = Book.objects.create(title="Dune")
+        Book.concurrent_titles.append("Children of Dune")
+        book.title = "Dune Messiah"
+        self.assert_(book.save())
+        self.assertEqual(["Dune", "Dune Messiah", "Children of Dune",
+                          "Dune Messiah"], Book.writes)
+        self.assertEqual("Dune Messiah", Book.objects.get_by_id(1).title)
+        self.assertEqual(set(['1']),
+                self.client.smembers('Book:title:Dune Messiah'))
+        self.assertEqual(0, self.client.scard('Book:title:Children of Dune'))
+        self.assertFalse(self.client.exists('Book:1:_lock'))
+
+    def test_unknown_engine(self):
+        def create_model():
+            class Book(models.Model):
+                class Meta:
+                    save_engine = 'pessimistic'
+        self.assertRaises(ValueError, create_model)
+
+
+class ScriptSaveTestCase(RediscoTestCase):
+
+    def setUp(self):
+        super(ScriptSaveTestCase, self).setUp()
+
+        class Book(models.Model):
+            title = models.CharField()
+            isbn = models.CharField(unique=True)
+            pages = models.IntegerField()
+            tags = models.ListField(str)
+
+            class Meta:
+                save_engine = 'script'
+
+        self.Book = Book
+
+    def test_save(self):
+        book = self.Book.objects.create(title="Dune", isbn="0441013597",
+                pages=412, tags=['sf', 'classic'])
+        self.assert_(book)
+        book = self.Book.objects.get_by_id(book.id)
+        self.assertEqual("Dune", book.title)
+        self.assertEqual(412, book.pages)
+        self.assertEqual(['sf', 'classic'], book.tags)
+        self.assertEqual(book, self.Book.objects.filter(tags='sf').first())
+        self.assertEqual(book, self.Book.objects.zfilter(pages__gt=400).first())
+        self.assertEqual(book, self.Book.objects.get_by_unique(isbn="0441013597"))
+
+        book.title = "Dune Messiah"
+        book.isbn = "0593098234"
+        book.pages = None
+        book.tags = ['sf']
+        self.assert_(book.save())
+        self.assertEqual(0, len(self.Book.objects.filter(title="Dune")))
+        self.assertEqual(0, len(self.Book.objects.filter(tags='classic')))
+        self.assertEqual(0, self.client.zcard('Book:pages'))
+        self.assertEqual(None, self.Book.objects.get_by_unique(isbn="0441013597"))
+        self.assertEqual(set(['Book:title:Dune Messiah', 'Book:tags:sf']),
+                self.client.smembers('Book:1:_indices'))
+        book = self.Book.objects.filter(title="Dune Messiah").first()
+        self.assertEqual(None, book.pages)
+        self.assertEqual("0593098234", book.isbn)
+
+        book.title = "Dune"
+        self.assert_(book.save())
+        self.assertEqual(book, self.Book.objects.filter(tags='sf').first())
+        book.tags.append('classic')
+        self.assert_(book.save())
+        self.assertEqual(['sf', 'classic'], self.client.lrange('Book:1:tags', 0, -1))
+        self.assertEqual(book, self.Book.objects.filter(tags='classic').first())
+
+        book.delete()
+        self.assertEqual(0, len(self.Book.objects.all()))
+        self.assertFalse(self.client.exists('Book:1:_indices'))
+
+    def test_unique_conflict(self):
+        self.Book.objects.create(title="Dune", isbn="0441013597")
+        book = self.Book(title="Dune", isbn="0441013597")
+        book._initialize_id()
+        self.assertEqual([('isbn', 'not unique')], book._save_script(True))
+        self.assertEqual(1, len(self.Book.objects.filter(title="Dune")))
+        self.assertEqual('1', self.client.hget('Book:isbn:_uniques',
+                                              "0441013597"))
+        self.assertFalse(self.client.exists(book.key()))
+
+
+class ScriptQueryTestCase(RediscoTestCase):
+
+    def setUp(self):
+        super(ScriptQueryTestCase, self).setUp()
+
+        class Song(models.Model):
+            title = models.CharField()
+            artist = models.CharField()
+            year = models.IntegerField()
+
+            class Meta:
+                query_engine = 'script'
+
+        self.Song = Song
+        Song.objects.create(title="Heroes", artist="Bowie", year=1977)
+        Song.objects.create(title="Changes", artist="Bowie", year=1971)
+        Song.objects.create(title="Roxanne", artist="Police", year=1978)
+        Song.objects.create(title="Lazarus", artist="Bowie", year=2016)
+
+    def titles(self, songs):
+        return [s.title for s in songs]
+
+    def test_query(self):
+        songs = self.Song.objects
+        self.assertEqual(['Heroes', 'Changes', 'Roxanne', 'Lazarus'],
+                         self.titles(songs.all()))
+        self.assertEqual(['Changes', 'Heroes', 'Lazarus'],
+                         self.titles(songs.filter(artist="Bowie").order('title')))
+        self.assertEqual(['Lazarus', 'Heroes', 'Changes'],
+                         self.titles(songs.filter(artist="Bowie").order('-year')))
+        self.assertEqual(['Heroes', 'Lazarus'],
+                         self.titles(songs.exclude(title="Changes")
+                                          .exclude(artist="Police")))
+        self.assertEqual(3, len(songs.filter(artist="Bowie")))
+        self.assertEqual(set(['Heroes', 'Changes', 'Lazarus']),
+                set(self.titles(songs.filter(artist="Bowie").unordered())))
+        self.assertEqual([], self.client.keys('~*'))
+
+    def test_page(self):
+        bowie = self.Song.objects.filter(artist="Bowie").order('year')
+        self.Song.objects.filter(artist="Bowie").limit(1).first()
+        calls = []
+        execute = self.client.execute_command
+        def execute_command(*args, **options):
+            calls.append(args[0])
+            return execute(*args, **options)
+        self.client.execute_command = execute_command
+        try:
+            page = bowie.limit(2, offset=1)
+            self.assertEqual(['Heroes', 'Lazarus'], self.titles(page))
+            self.assertEqual(['Heroes', 'Lazarus'], self.titles(page))
+            self.assertEqual('Changes', bowie.first().title)
+        finally:
+            del self.client.execute_command
+        self.assertEqual(['EVALSHA', 'EVALSHA'], calls)
+        self.assertEqual(1977, page[0].year)
+        self.assertEqual(0, len(bowie.limit(2, offset=3)))
+        self.assertEqual(['Heroes'], self.titles(bowie.only('title').limit(1, 1)))
+        self.assertEqual([], self.client.keys('~*'))
+
+    def test_zfilters(self):
+        bowie = self.Song.objects.filter(artist="Bowie")
+        self.assertEqual(['Changes', 'Heroes'],
+                         self.titles(bowie.zfilter(year__lt=2000)))
+        self.assertEqual(['Heroes', 'Changes'],
+                self.titles(bowie.zfilter(year__lt=2000).order('-title')))
+        self.assertEqual(['Heroes'], self.titles(
+                self.Song.objects.exclude(title="Changes")
+                                 .zfilter(year__in=(1970, 1977))))
+        self.assertEqual(['Heroes', 'Lazarus'],
+                self.titles(bowie.zfilter(year__gt=1971).limit(2)))
+        self.assertEqual(['Heroes', 'Roxanne'], self.titles(
+                self.Song.objects.zfilter(year__gt=1971).limit(2)))
+        self.assertEqual(['Roxanne'], self.titles(self.Song.objects
+                .zfilter(year__gt=1971).zfilter(year__lt=2000).limit(1, 1)))
+        self.assertEqual([], self.client.keys('~*'))
+
+    def test_unknown_engine(self):
+        def define():
+            class Album(models.Model):
+                class Meta:
+                    query_engine = 'lua'
+        self.assertRaises(ValueError, define)
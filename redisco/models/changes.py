@@ -0,0 +1,84 @@
+"""
+Changes of the objects, as written by the models.
+"""
+from redisco.containers import List
+
+
+class ObjectChanges(object):
+    """
+    The changes of an object since it was stored: the fields of its hash
+    to set and to delete, the index sets it joins and leaves, the scores
+    of its sorted set indices and its changed lists.
+
+    The changes are taken from the instance when it is saved (see
+    ``Model._changes``). They do not refer to the instance, can be merged
+    with the changes of a later save of the same object and queued into
+    a pipeline from any thread.
+    """
+    def __init__(self, instance):
+        self.id = instance.id
+        self.key = instance.key()
+        self.all_key = instance._key['all']
+        self.version_key = instance._key['_version']
+        self.hset = {}
+        self.hdel = set()
+        self.joined = set()
+        self.left = set()
+        self.scores = {}
+        self.zjoined = set()
+        self.zleft = set()
+        # list key -> (values, start), see ``Model._list_changes``
+        self.lists = {}
+
+    def merge(self, later):
+        """
+        Adds the ``later`` changes of the same object to these ones and
+        returns them, as if both were written in turn.
+        """
+        for field in later.hdel:
+            self.hset.pop(field, None)
+        self.hset.update(later.hset)
+        self.hdel = (self.hdel - set(later.hset)) | later.hdel
+        self.joined, self.left = ((self.joined - later.left) | later.joined,
+                                  (self.left - later.joined) | later.left)
+        for zindex in later.zleft:
+            self.scores.pop(zindex, None)
+        self.scores.update(later.scores)
+        self.zjoined, self.zleft = (
+                (self.zjoined - later.zleft) | later.zjoined,
+                (self.zleft - later.zjoined) | later.zleft)
+        for key, (values, start) in later.lists.iteritems():
+            if start is not None and key in self.lists:
+                # appended to the list written by these changes
+                start = self.lists[key][1]
+            self.lists[key] = (values, start)
+        return self
+
+    def queue(self, pipeline):
+        """
+        Queues the writes of the changes into ``pipeline``.
+        """
+        pipeline.sadd(self.all_key, self.id)
+        for index in self.left:
+            pipeline.srem(index, self.id)
+            pipeline.srem(self.key['_indices'], index)
+        for index in self.joined:
+            pipeline.sadd(index, self.id)
+            pipeline.sadd(self.key['_indices'], index)
+        for zindex in self.zleft:
+            pipeline.zrem(zindex, self.id)
+            pipeline.srem(self.key['_zindices'], zindex)
+        for zindex, score in self.scores.iteritems():
+            if zindex in self.zjoined:
+                pipeline.sadd(self.key['_zindices'], zindex)
+            pipeline.zadd(zindex, self.id, score)
+        if self.hset:
+            pipeline.hmset(self.key, self.hset)
+        for key, (values, start) in self.lists.iteritems():
+            l = List(key, pipeline=pipeline)
+            if start is None:
+                l.clear()
+            if values[start or 0:]:
+                l.extend(values[start or 0:])
+        if self.hdel:
+            pipeline.hdel(self.key, *self.hdel)
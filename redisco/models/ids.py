@@ -0,0 +1,122 @@
+"""
+Allocation of the ids of the new objects.
+"""
+import os
+import threading
+import time
+import uuid
+import redisco
+
+
+class IdBlockAllocator(object):
+    """
+    Hands out the ids of a model from blocks of ``size`` ids, each block
+    being reserved with a single INCRBY of the id key of the model.
+
+    The allocator is shared by the threads of a process. A forked
+    process drops the block inherited from its parent so that both do
+    not hand out the same ids.
+    """
+    def __init__(self, key, size):
+        self.key = key
+        self.size = size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = 1
+        self._last = 0
+
+    def allocate(self, db, n=1):
+        """
+        Returns a list of ``n`` new ids, reserving a new block with
+        ``db`` when the current one is exhausted.
+        """
+        ids = []
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next, self._last = 1, 0
+            while len(ids) < n:
+                if self._next > self._last:
+                    count = max(self.size, n - len(ids))
+                    self._last = db.incrby(self.key, count)
+                    self._next = self._last - count + 1
+                take = min(n - len(ids), self._last - self._next + 1)
+                ids.extend(str(id) for id in
+                           xrange(self._next, self._next + take))
+                self._next += take
+        return ids
+
+
+class SnowflakeGenerator(object):
+    """
+    Generates 64-bit ids made of the time in milliseconds (41 bits), the
+    id of the worker (10 bits) and a sequence number within the
+    millisecond (12 bits), without any round trip to Redis.
+
+    The ids are time-ordered and have 19 digits until 2080. Two
+    processes must never use the same worker id at the same time. When
+    ``worker_id`` is not given, each process reserves one with an INCR
+    of the ``key`` on its first id, modulo 1024: the processes running
+    at the same time then get distinct worker ids as long as fewer than
+    1024 processes were started while the oldest one runs.
+    """
+    epoch = 1288834974657
+
+    def __init__(self, worker_id=None, key='redisco:snowflake:worker'):
+        self.worker_id = worker_id
+        self.key = key
+        self._lock = threading.Lock()
+        self._pid = None
+        self._worker = None
+        self._last = -1
+        self._sequence = 0
+
+    def __call__(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._worker = self.worker_id
+                if self._worker is None:
+                    self._worker = redisco.get_client().incr(self.key)
+                self._worker &= 0x3ff
+            # never go back in time, and borrow the next millisecond
+            # when the sequence is exhausted
+            now = max(int(time.time() * 1000), self._last)
+            if now == self._last:
+                self._sequence = (self._sequence + 1) & 0xfff
+                if self._sequence == 0:
+                    now += 1
+            else:
+                self._sequence = 0
+            self._last = now
+            return str(((now - self.epoch) << 22) | (self._worker << 12) |
+                       self._sequence)
+
+
+_CROCKFORD = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+def ulid():
+    """
+    Returns a ULID: the time in milliseconds (48 bits) followed by 80
+    random bits, encoded in 26 characters of Crockford's base32. ULIDs
+    generated in different milliseconds sort by time.
+    """
+    value = ((int(time.time() * 1000) << 80) |
+             int(os.urandom(10).encode('hex'), 16))
+    chars = []
+    for i in xrange(26):
+        value, r = divmod(value, 32)
+        chars.append(_CROCKFORD[r])
+    return ''.join(reversed(chars))
+
+
+def uuid4():
+    """Returns a random UUID."""
+    return str(uuid.uuid4())
+
+
+ID_GENERATORS = {
+    'snowflake': SnowflakeGenerator(),
+    'ulid': ulid,
+    'uuid4': uuid4,
+}
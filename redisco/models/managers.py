@@ -27,6 +27,9 @@ class Manager(object):
     def create(self, **kwargs):
         return self.get_model_set().create(**kwargs)
 
+    def bulk_create(self, instances, batch_size=None):
+        return self.get_model_set().bulk_create(instances, batch_size)
+
     def get_or_create(self, **kwargs):
         return self.get_model_set().get_or_create(**kwargs)
 
@@ -39,6 +42,12 @@ class Manager(object):
     def get_by_id(self, id):
         return self.get_model_set().get_by_id(id)
 
+    def get_many(self, ids):
+        return self.get_model_set().get_many(ids)
+
+    def in_bulk(self, ids):
+        return self.get_model_set().in_bulk(ids)
+
     def get_by_unique(self, **kwargs):
         assert len(kwargs) == 1
         return self.get_model_set().get_by_unique(
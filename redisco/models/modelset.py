@@ -1,11 +1,41 @@
 """
 Handles the queries.
 """
+import hashlib
+from itertools import islice
+from redis.exceptions import WatchError
 from attributes import IntegerField, DateTimeField
 import redisco
 from redisco.containers import SortedSet, Set, List, NonPersistentList
-from exceptions import AttributeNotIndexed
-from attributes import ZINDEXABLE
+from exceptions import AttributeNotIndexed, FieldValidationError
+from attributes import ZINDEXABLE, Counter
+from scripts import QUERY, UPDATE_OBJECTS
+import writebehind
+
+def _complement_bound(bound):
+    """
+    Returns the ZRANGEBYSCORE bound of the scores on the other side of
+    ``bound``: ``'(3.0'`` for ``'3.0'`` and ``'3.0'`` for ``'(3.0'``.
+    """
+    if bound.startswith('('):
+        return bound[1:]
+    return '(' + bound
+
+def _score_within(score, min, max):
+    """
+    Returns True if ``score`` is within the ZRANGEBYSCORE bounds ``min``
+    and ``max``. A missing score (None) is not.
+    """
+    if score is None:
+        return False
+    if min.startswith('('):
+        if score <= float(min[1:]):
+            return False
+    elif score < float(min):
+        return False
+    if max.startswith('('):
+        return score < float(max[1:])
+    return score <= float(max)
 
 # Model Set
 class ModelSet(Set):
@@ -19,6 +49,12 @@ class ModelSet(Set):
         self._ordering = []
         self._limit = None
         self._offset = None
+        self._chunk_size = None
+        self._select_related = []
+        self._prefetch_related = []
+        self._only = None
+        self._defer = []
+        self._unordered = False
 
     #################
     # MAGIC METHODS #
@@ -28,8 +64,12 @@ class ModelSet(Set):
         """
         Will look in _set to get the id and simply return the instance of the model.
         """
+        if hasattr(self, '_result_cache'):
+            return self._result_cache[index]
+        if self._fetches_page():
+            return self._fetch_page()[index]
         if isinstance(index, slice):
-            return map(lambda id: self._get_item_with_id(id), self._set[index])
+            return self._get_items_with_ids(self._set[index])
         else:
             id = self._set[index]
             if id:
@@ -38,22 +78,29 @@ class ModelSet(Set):
                 raise IndexError
 
     def __repr__(self):
+        if hasattr(self, '_result_cache'):
+            return "%s" % self._result_cache[:30]
         if len(self._set) > 30:
             m = self._set[:30]
         else:
             m = self._set
-        s = map(lambda id: self._get_item_with_id(id), m)
+        s = self._get_items_with_ids(m)
         return "%s" % s
 
     def __iter__(self):
-        for id in self._set:
-            yield self._get_item_with_id(id)
+        if hasattr(self, '_result_cache'):
+            return iter(self._result_cache)
+        if self._fetches_page():
+            return iter(self._fetch_page())
+        return self._iter_items_with_ids(self._iter_ids())
 
     def __len__(self):
+        if self._is_unordered():
+            return self.db.scard(self._unordered_key)
         return len(self._set)
 
     def __contains__(self, val):
-        return val.id in self._set
+        return self._has_id(val.id)
 
     ##########################################
     # METHODS THAT RETURN A SET OF INSTANCES #
@@ -78,10 +125,53 @@ class ModelSet(Set):
         >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
         [...]
         """
-        if (self._filters or self._exclusions or self._zfilters) and str(id) not in self._set:
-            return
-        if self.model_class.exists(id):
-            return self._get_item_with_id(id)
+        members = None
+        if self._filters or self._exclusions or self._zfilters:
+            members = self._members_key()
+            if members is None and not self._has_id(str(id)):
+                return
+        objects = self._fetch_chunk([id], check_exists=True, members=members)
+        if objects:
+            return objects[0]
+
+    def get_many(self, ids):
+        """
+        Returns the objects defined by ``ids``, fetched with one
+        pipeline for each chunk of ids.
+
+        :param ids: the ``ids`` of the objects to lookup.
+        :returns: the list of instances, in the order of ``ids``. Objects
+                  that do not exist (or are not part of the collection)
+                  are skipped.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> f = Foo(name="Einstein")
+        >>> f.save()
+        True
+        >>> Foo.objects.get_many([f.id, 'unknown']) == [f]
+        True
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        ids = [str(id) for id in ids]
+        members = None
+        if self._filters or self._exclusions or self._zfilters:
+            members = self._members_key()
+            if members is None:
+                looked_up = set(self._set)
+                ids = [id for id in ids if id in looked_up]
+        return list(self._iter_items_with_ids(ids, check_exists=True,
+                                              members=members))
+
+    def in_bulk(self, ids):
+        """
+        Same as ``get_many`` but returns a dict mapping the ``id`` of
+        each object found to its instance.
+        """
+        return dict((o.id, o) for o in self.get_many(ids))
 
     def get_by_unique(self, att, value):
         """
@@ -110,8 +200,7 @@ class ModelSet(Set):
         id = self.model_class.get_id_by_unique(att, value)
         if id is None:
             return None
-        assert (self.model_class.exists(id))
-        return self._get_item_with_id(id)
+        return self.get_by_id(id)
 
     def first(self):
         """
@@ -191,10 +280,38 @@ class ModelSet(Set):
         return clone
 
     def zfilter(self, **kwargs):
+        """
+        Filter a collection on ranges of scores of the sorted set
+        indices, with the operators ``lt``, ``lte``, ``gt``, ``gte``
+        and ``in`` (a couple of inclusive bounds). The ranges can be
+        combined with each other and with ``filter`` and ``exclude``.
+
+        Unless ordered, the collection is sorted by the score of the
+        first range.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...     size = models.IntegerField()
+        ...     price = models.FloatField()
+        ...
+        >>> Foo(name="a", size=3, price=2.5).save()
+        True
+        >>> Foo(name="b", size=1, price=9.5).save()
+        True
+        >>> Foo(name="c", size=2, price=3.0).save()
+        True
+        >>> [f.name for f in Foo.objects.zfilter(size__gte=2)]
+        [u'c', u'a']
+        >>> [f.name for f in Foo.objects.zfilter(size__in=(1, 2), price__lt=5)]
+        [u'c']
+        >>> [f.name for f in Foo.objects.exclude(name="c").zfilter(size__gt=0)]
+        [u'b', u'a']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
         clone = self._clone()
-        if not clone._zfilters:
-            clone._zfilters = []
-        clone._zfilters.append(kwargs)
+        clone._zfilters = clone._zfilters + [kwargs]
         return clone
 
     # this should only be called once
@@ -242,6 +359,196 @@ class ModelSet(Set):
         clone._offset = offset
         return clone
 
+    def chunk(self, size):
+        """
+        Set the number of objects fetched in a single pipeline when
+        iterating or slicing the collection. Defaults to
+        ``redisco.default_chunk_size``.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> Foo(name="Einstein").save()
+        True
+        >>> [f.name for f in Foo.objects.all().chunk(500)]
+        [u'Einstein']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        clone = self._clone()
+        clone._chunk_size = size
+        return clone
+
+    def unordered(self):
+        """
+        Read the ids of the collection straight from the set of the
+        objects, or from the intersection of the filtered indices,
+        instead of sorting them into a temporary key. The objects come in
+        no particular order: the iteration scans the set with SSCAN and
+        ``len`` is a SCARD.
+
+        It has no effect on an ordered or limited collection, nor on a
+        ``zfilter``.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> Foo(name="Einstein").save()
+        True
+        >>> len(Foo.objects.filter(name="Einstein").unordered())
+        1
+        >>> [f.name for f in Foo.objects.all().unordered()]
+        [u'Einstein']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        clone = self._clone()
+        clone._unordered = True
+        return clone
+
+    def select_related(self, *fields):
+        """
+        Load the objects targeted by the reference fields ``fields``
+        along with the collection, with one batch for each chunk of
+        objects instead of one lookup for each instance.
+
+        >>> from redisco import models
+        >>> class Author(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> class Book(models.Model):
+        ...     title = models.Attribute()
+        ...     author = models.ReferenceField(Author)
+        ...
+        >>> a = Author.objects.create(name="Tolkien")
+        >>> Book(title="The Hobbit", author=a).save()
+        True
+        >>> [b.author.name for b in Book.objects.all().select_related('author')]
+        [u'Tolkien']
+        >>> [o.delete() for o in list(Book.objects.all()) +
+        ...  list(Author.objects.all())] # doctest: +ELLIPSIS
+        [...]
+        """
+        for field in fields:
+            if field not in self.model_class._references:
+                raise ValueError("%s is not a reference field of %s." %
+                        (field, self.model_class.__name__))
+        clone = self._clone()
+        clone._select_related = self._select_related + list(fields)
+        return clone
+
+    def prefetch_related(self, *related_names):
+        """
+        Load the related sets ``related_names`` (eg: ``book_set``)
+        installed by the reference fields that target the model, with
+        one batch for each chunk of objects.
+
+        >>> from redisco import models
+        >>> class Author(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> class Book(models.Model):
+        ...     title = models.Attribute()
+        ...     author = models.ReferenceField(Author)
+        ...
+        >>> a = Author.objects.create(name="Tolkien")
+        >>> Book(title="The Hobbit", author=a).save()
+        True
+        >>> [list(a.book_set) for a in Author.objects.all().prefetch_related('book_set')] # doctest: +ELLIPSIS
+        [[<Book:...>]]
+        >>> [o.delete() for o in list(Book.objects.all()) +
+        ...  list(Author.objects.all())] # doctest: +ELLIPSIS
+        [...]
+        """
+        for related_name in related_names:
+            if related_name not in self.model_class._related:
+                raise ValueError("%s is not a related set of %s." %
+                        (related_name, self.model_class.__name__))
+        clone = self._clone()
+        clone._prefetch_related = self._prefetch_related + list(related_names)
+        return clone
+
+    def only(self, *fields):
+        """
+        Load only the attributes ``fields`` of the objects, with HMGET.
+        The other attributes are fetched on first access.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...     body = models.Attribute(indexed=False)
+        ...
+        >>> Foo(name="Einstein", body="...").save()
+        True
+        >>> Foo.objects.all().only('name').first().name
+        u'Einstein'
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        clone = self._clone()
+        clone._only = self._field_names(fields)
+        return clone
+
+    def defer(self, *fields):
+        """
+        Load all the attributes of the objects but ``fields``, with
+        HMGET. The deferred attributes are fetched on first access.
+        """
+        clone = self._clone()
+        clone._defer = self._defer + self._field_names(fields)
+        return clone
+
+    def values(self, *fields):
+        """
+        Returns a generator of dicts mapping ``fields`` (all the
+        attributes and ``id`` by default) to their values, read with
+        one pipeline of HMGET for each chunk of objects, without
+        instantiating the model.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...     age = models.IntegerField()
+        ...
+        >>> Foo(name="Einstein", age=76).save()
+        True
+        >>> list(Foo.objects.all().values('name', 'age'))
+        [{'age': 76, 'name': u'Einstein'}]
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        fields = self._values_fields(fields)
+        return (dict(zip(fields, row)) for row in self._iter_rows(fields))
+
+    def values_list(self, *fields, **kwargs):
+        """
+        Same as ``values`` but yields tuples. If ``flat`` is True and a
+        single field is given, the values are yielded alone.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> Foo(name="Einstein").save()
+        True
+        >>> list(Foo.objects.all().values_list('name', flat=True))
+        [u'Einstein']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        flat = kwargs.pop('flat', False)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments to values_list: %s"
+                    % kwargs.keys())
+        if flat and len(fields) != 1:
+            raise TypeError("flat is only valid with a single field.")
+        fields = self._values_fields(fields)
+        if flat:
+            return (row[0] for row in self._iter_rows(fields))
+        return self._iter_rows(fields)
+
     def create(self, **kwargs):
         """
         Create an object of the class.
@@ -263,6 +570,207 @@ class ModelSet(Set):
         else:
             return None
 
+    def bulk_create(self, instances, batch_size=None):
+        """
+        Save all the new ``instances`` of the class at once: the ids are
+        reserved with a single INCRBY (or taken from the block of ids of
+        the process, see the ``id_block_size`` option of
+        ``ModelOptions``) and the objects are written with one pipeline
+        for each batch of ``batch_size`` instances (see
+        ``redisco.default_chunk_size``), without locking them.
+
+        The unique values are claimed with HSETNX like ``save`` does, with
+        one pipeline for each batch.
+
+        If any instance is not valid, nothing is written and a
+        ``FieldValidationError`` with all the errors is raised. The
+        errors of each instance are available in its ``errors``.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> Foo.objects.bulk_create([Foo(name="Obama"), Foo(name="Lincoln")]) # doctest: +ELLIPSIS
+        [<Foo:...>, <Foo:...>]
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        instances = list(instances)
+        errors = []
+        for instance in instances:
+            if not instance._is_valid(check_uniques=False):
+                errors.extend(instance._errors)
+        if errors:
+            raise FieldValidationError(errors)
+
+        news = [o for o in instances if o.is_new()]
+        if news:
+            ids = self.model_class._allocate_ids(len(news))
+            for instance, id in zip(news, ids):
+                instance._id = id
+        news = set(news)
+
+        size = batch_size or redisco.default_chunk_size
+        errors, claimed, released = self._claim_bulk_uniques(instances,
+                                                             news, size)
+        if errors:
+            for instance in news:
+                del instance._id
+            raise FieldValidationError(errors)
+        for i in xrange(0, len(instances), size):
+            pipeline = self.db.pipeline()
+            for instance, values in zip(instances[i:i + size],
+                                        released[i:i + size]):
+                instance._release_uniques(values, pipeline)
+                instance._write(instance in news, pipeline)
+            try:
+                pipeline.execute()
+            except Exception:
+                # release the values of the objects that were not written
+                unwritten = set(o.id for o in instances[i:])
+                self.model_class._release_uniques(
+                        [(k, v) for k, v, id in claimed if id in unwritten],
+                        self.db)
+                raise
+        return instances
+
+    def delete(self):
+        """
+        Delete all the objects of the collection without loading them
+        and return the number of deleted objects.
+
+        The ids are streamed by chunks (see ``chunk``) with SSCAN, unless
+        the collection is limited: the index keys and the unique values
+        of a chunk of objects are read with one pipeline, and the objects
+        are removed from their indices, their uniques and the datastore
+        with another one.
+
+        The pending writes of the models with the ``write_behind``
+        option are flushed first, and the ones made meanwhile to the
+        deleted objects are dropped.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...
+        >>> Foo.objects.bulk_create([Foo(name="Obama"), Foo(name="Lincoln")]) # doctest: +ELLIPSIS
+        [<Foo:...>, <Foo:...>]
+        >>> Foo.objects.filter(name="Obama").delete()
+        1
+        >>> Foo.objects.all().delete()
+        1
+        """
+        key = self.model_class._key
+        uniques = self.model_class._uniques
+        lists = self.model_class._lists.keys()
+        if self.model_class._write_behind:
+            writebehind.flush()
+        ids = self._stream_ids()
+        size = self._chunk_size or redisco.default_chunk_size
+        step = 3 if uniques else 2
+        deleted = 0
+        while True:
+            chunk = list(islice(ids, size))
+            if not chunk:
+                break
+            pipeline = self.db.pipeline(transaction=False)
+            for id in chunk:
+                pipeline.smembers(key[id]['_indices'])
+                pipeline.smembers(key[id]['_zindices'])
+                if uniques:
+                    pipeline.hmget(key[id], uniques)
+            results = pipeline.execute()
+
+            pipeline = self.db.pipeline()
+            for n, id in enumerate(chunk):
+                indices, zindices = results[step * n:step * n + 2]
+                values = results[step * n + 2] if uniques else []
+                for index in indices:
+                    pipeline.srem(index, id)
+                for zindex in zindices:
+                    pipeline.zrem(zindex, id)
+                for att, value in zip(uniques, values):
+                    if value is not None:
+                        pipeline.hdel(key[att]['_uniques'], value)
+                pipeline.delete(key[id], key[id]['_indices'],
+                                key[id]['_zindices'],
+                                *[key[id][k] for k in lists])
+            self.model_class._bump_version(pipeline)
+            pipeline.srem(key['all'], *chunk)
+            deleted += pipeline.execute()[-1]
+            if self.model_class._write_behind:
+                writebehind.buffer.discard(*[key[id] for id in chunk])
+        self._reset_cache()
+        return deleted
+
+    def update(self, **kwargs):
+        """
+        Set the values of ``kwargs`` on all the objects of the collection
+        without loading them and return the number of updated objects.
+
+        The ids are processed by chunks (see ``chunk``), each one with a
+        single call of the ``UPDATE_OBJECTS`` Lua script: the objects are
+        moved from the index of their stored value to the one of the new
+        value and their hashes are updated atomically. The objects deleted
+        in the meantime are skipped. The ``auto_now`` dates are left
+        untouched.
+
+        The pending writes of the models with the ``write_behind``
+        option are flushed first.
+
+        Unique attributes, lists and counters cannot be updated this way
+        and raise a ``ValueError``. A ``FieldValidationError`` is raised,
+        and nothing is written, if a value is not valid.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.Attribute()
+        ...     status = models.Attribute()
+        ...
+        >>> Foo.objects.bulk_create([Foo(name="Obama", status="active"),
+        ...                          Foo(name="Lincoln", status="active")]) # doctest: +ELLIPSIS
+        [<Foo:...>, <Foo:...>]
+        >>> Foo.objects.filter(name="Lincoln").update(status="archived")
+        1
+        >>> len(Foo.objects.filter(status="archived"))
+        1
+        >>> Foo.objects.all().delete()
+        2
+        """
+        values = self._update_values(kwargs)
+        if self.model_class._write_behind:
+            writebehind.flush()
+        key = self.model_class._key
+        attributes = self.model_class._attributes
+        if [i for i in self.model_class._indices
+                if i not in attributes and i not in self.model_class._lists]:
+            # the indices defined in Meta may depend on any value
+            return self._update_instances(values)
+        h = dict((att, attributes[att].typecast_for_storage(value))
+                 for att, value in values.iteritems() if value is not None)
+        keys_to_be_delete = [att for att, value in values.iteritems()
+                             if value is None]
+        args = [len(h)]
+        for item in h.iteritems():
+            args.extend(item)
+        args.append(len(keys_to_be_delete))
+        args.extend(keys_to_be_delete)
+        indexed = [att for att in values if att in self.model_class._indices]
+        args.append(len(indexed))
+        for att in indexed:
+            args.extend([att, int(isinstance(attributes[att], ZINDEXABLE)),
+                         int(att in h), h.get(att, '')])
+        ids = list(self._set)
+        size = self._chunk_size or redisco.default_chunk_size
+        updated = 0
+        for i in xrange(0, len(ids), size):
+            chunk = ids[i:i + size]
+            updated += int(UPDATE_OBJECTS(self.db,
+                    keys=[key['all'], key['_version']],
+                    args=[key, len(chunk)] + chunk + args))
+        self._reset_cache()
+        return updated
+
     def all(self):
         """
         Return all elements of the collection.
@@ -311,20 +819,149 @@ class ModelSet(Set):
         filtered and ordered. This set is build hen we first access
         it and is cached for has long has the ModelSet exist.
         """
-        # For performance reasons, only one zfilter is allowed.
         if hasattr(self, '_cached_set'):
             return self._cached_set
+        if self._is_unordered():
+            self._cached_set = list(self.db.smembers(self._unordered_key))
+            return self._cached_set
+        if self.model_class._query_engine == 'script':
+            self._cached_set = self._query_script()[0]
+            return self._cached_set
         if self._zfilters:
-            self._cached_set = self._add_zfilters()
+            ranges = self._zfilter_ranges()
+            if (len(ranges) == 1 and not self._ordering and
+                    not self._filters and not self._exclusions):
+                # read the range straight from its index
+                num, start = self._get_limit_and_offset()
+                self._cached_set = self.db.zrangebyscore(*ranges[0],
+                        start=start, num=num)
+                return self._cached_set
+            zkey = self._add_zfilters(self._unordered_key)
+            if self._ordering:
+                self._cached_set = self._set_with_ordering(zkey)
+            else:
+                self._cached_set = self._zrange(zkey)
             return self._cached_set
+        n = self._order(self._unordered_key)
+        self._cached_set = n
+        return self._cached_set
+
+    @property
+    def _unordered_key(self):
+        """
+        The key of the set of the ids matching the filters and the
+        exclusions, before any ordering: the ``all`` set of the model or
+        a temporary intersection of the indices.
+        """
+        if hasattr(self, '_cached_key'):
+            return self._cached_key
         s = Set(self.key)
         if self._filters:
             s = self._add_set_filter(s)
         if self._exclusions:
             s = self._add_set_exclusions(s)
-        n = self._order(s.key)
-        self._cached_set = n
-        return self._cached_set
+        self._cached_key = s.key
+        return self._cached_key
+
+    def _is_unordered(self):
+        """
+        Returns True if the ids are read straight from the set of
+        ``_unordered_key`` (see ``unordered``). The ``QUERY`` script
+        skips the sort of such collections instead.
+        """
+        return (self._unordered and not self._ordering and
+                self._limit is None and not self._zfilters and
+                self.model_class._query_engine != 'script')
+
+    def _iter_ids(self):
+        """
+        Yields the ids of the collection. An unordered collection is
+        scanned with SSCAN, by chunks.
+        """
+        if hasattr(self, '_cached_set') or not self._is_unordered():
+            return iter(self._set)
+        return self._scan_ids()
+
+    def _scan_ids(self):
+        size = self._chunk_size or redisco.default_chunk_size
+        seen = set()
+        # SSCAN may return an id more than once
+        for id in self.db.sscan_iter(self._unordered_key, count=size):
+            if id not in seen:
+                seen.add(id)
+                yield id
+
+    def _stream_ids(self):
+        """
+        Yields the ids of the collection in no particular order, scanning
+        the set of ``_members_key`` by chunks instead of sorting it. An
+        id may be yielded more than once.
+        """
+        members = self._members_key()
+        if members is None:
+            return iter(self._set)
+        key, bounds = members
+        size = self._chunk_size or redisco.default_chunk_size
+        if bounds is None:
+            return self.db.sscan_iter(key, count=size)
+        if bounds == ('-inf', '+inf'):
+            return (id for id, score in self.db.zscan_iter(key, count=size))
+        return self._stream_range(key, bounds, size)
+
+    def _stream_range(self, key, bounds, size):
+        """
+        Yields the ids of the sorted set ``key`` whose score is within
+        ``bounds``, with one ZRANGEBYSCORE for each chunk. Each chunk
+        starts from the last score read, so that the ids removed
+        meanwhile (see ``delete``) do not shift the next chunks.
+        """
+        min, max = bounds
+        last, seen = None, set()
+        while True:
+            # the ids of the last score read come back first
+            num = size + len(seen)
+            page = self.db.zrangebyscore(key, min, max, start=0, num=num,
+                                         withscores=True)
+            for id, score in page:
+                if id not in seen:
+                    yield id
+            if len(page) < num:
+                return
+            score = page[-1][1]
+            if score != last:
+                last, seen = score, set()
+            seen.update(id for id, s in page if s == score)
+            min = repr(score)
+
+    def _members_key(self):
+        """
+        Returns the key of the set of the ids of the collection, to
+        check ids against it on the server, and the bounds of the scores
+        of the ids when it is a sorted set (None otherwise). A single
+        ``zfilter`` range without filters nor exclusions is checked
+        against its index, other ranges against the sorted set of
+        ``_add_zfilters``. Returns None when the ids have to be looked up
+        instead: the collection is limited or already looked up.
+        """
+        if hasattr(self, '_cached_set') or self._limit is not None:
+            return None
+        if self._zfilters:
+            ranges = self._zfilter_ranges()
+            if (len(ranges) == 1 and not self._filters and
+                    not self._exclusions):
+                index, min, max = ranges[0]
+                return index, (min, max)
+            return (self._add_zfilters(self._unordered_key),
+                    ('-inf', '+inf'))
+        return self._unordered_key, None
+
+    def _has_id(self, id):
+        """
+        Returns True if ``id`` belongs to the collection.
+        """
+        if not hasattr(self, '_cached_set') and self._is_unordered():
+            return self.db.sismember(self._unordered_key, id)
+        return id in self._set
 
     def _add_set_filter(self, s):
         """
@@ -336,19 +973,11 @@ class ModelSet(Set):
 
         :return: the new Set
         """
-        indices = []
-        for k, v in self._filters.iteritems():
-            index = self._build_key_from_filter_item(k, v)
-            if k not in self.model_class._indices:
-                raise AttributeNotIndexed(
-                        "Attribute %s is not indexed in %s class." %
-                        (k, self.model_class.__name__))
-            indices.append(index)
-        new_set_key = "~%s.%s" % ("+".join([self.key] + indices), id(self))
-        s.intersection(new_set_key, *[Set(n) for n in indices])
-        new_set = Set(new_set_key)
-        new_set.set_expire()
-        return new_set
+        indices = self._index_keys(self._filters)
+        new_set_key = self._temp_key('filter', s.key, indices)
+        self._store_temp_key(new_set_key, lambda pipeline:
+                pipeline.sinterstore(new_set_key, [s.key] + indices))
+        return Set(new_set_key)
 
     def _add_set_exclusions(self, s):
         """
@@ -360,55 +989,102 @@ class ModelSet(Set):
 
         :return: the new Set
         """
+        indices = self._index_keys(self._exclusions)
+        new_set_key = self._temp_key('exclude', s.key, indices)
+        self._store_temp_key(new_set_key, lambda pipeline:
+                pipeline.sdiffstore(new_set_key, [s.key] + indices))
+        return Set(new_set_key)
+
+    def _index_keys(self, conditions):
+        """
+        Returns the sorted keys of the index sets of the ``filter`` or
+        ``exclude`` conditions.
+        """
         indices = []
-        for k, v in self._exclusions.iteritems():
+        for k, v in conditions.iteritems():
             index = self._build_key_from_filter_item(k, v)
             if k not in self.model_class._indices:
                 raise AttributeNotIndexed(
                         "Attribute %s is not indexed in %s class." %
                         (k, self.model_class.__name__))
             indices.append(index)
-        new_set_key = "~%s.%s" % ("-".join([self.key] + indices), id(self))
-        s.difference(new_set_key, *[Set(n) for n in indices])
-        new_set = Set(new_set_key)
-        new_set.set_expire()
-        return new_set
+        indices.sort()
+        return indices
 
-    def _add_zfilters(self):
+    def _zfilter_ranges(self):
         """
-        This function is the internals of the zfilter function.
-        It will create a SortedSet and will compare the scores to
-        the value provided.
+        Returns the list of the ``zfilter`` conditions as tuples of the
+        key of the sorted set index and of the min and max scores, in
+        the syntax of ZRANGEBYSCORE.
+        """
+        ranges = []
+        for zfilter in self._zfilters:
+            for k, v in sorted(zfilter.items()):
+                try:
+                    att, op = k.split('__')
+                except ValueError:
+                    raise ValueError("zfilter should have an operator.")
+                desc = self.model_class._attributes[att]
+                score = lambda v: repr(float(desc.typecast_for_storage(v)))
+                if op == 'lt':
+                    bounds = ('-inf', '(' + score(v))
+                elif op == 'gt':
+                    bounds = ('(' + score(v), '+inf')
+                elif op == 'gte':
+                    bounds = (score(v), '+inf')
+                elif op == 'lte':
+                    bounds = ('-inf', score(v))
+                elif op == 'in':
+                    min, max = v
+                    bounds = (score(min), score(max))
+                else:
+                    raise ValueError("Unknown zfilter operator %s." % op)
+                ranges.append((self.model_class._key[att],) + bounds)
+        return ranges
 
-        :return: a SortedSet with the ids.
+    def _add_zfilters(self, skey):
+        """
+        This function is the internals of the zfilter function.
+        It intersects the ids of ``skey`` with the sorted set index of
+        each range and removes the scores out of the range, on the
+        server and in one transaction. The ranges are applied in reverse
+        order so that the scores left are the ones of the first range.
+        Without filters nor exclusions, the ``all`` set is left out: the
+        last range starts from a copy of its index.
 
+        :return: the key of the SortedSet of the ids.
         """
+        ranges = self._zfilter_ranges()
+        zkey = self._temp_key('zfilter', skey, ranges)
 
-        k, v = self._zfilters[0].items()[0]
-        try:
-            att, op = k.split('__')
-        except ValueError:
-            raise ValueError("zfilter should have an operator.")
-        index = self.model_class._key[att]
-        desc = self.model_class._attributes[att]
-        zset = SortedSet(index)
-        limit, offset = self._get_limit_and_offset()
-        if isinstance(v, (tuple, list,)):
-            min, max = v
-            min = float(desc.typecast_for_storage(min))
-            max = float(desc.typecast_for_storage(max))
-        else:
-            v = float(desc.typecast_for_storage(v))
-        if op == 'lt':
-            return zset.lt(v, limit, offset)
-        elif op == 'gt':
-            return zset.gt(v, limit, offset)
-        elif op == 'gte':
-            return zset.ge(v, limit, offset)
-        elif op == 'lte':
-            return zset.le(v, limit, offset)
-        elif op == 'in':
-            return zset.between(min, max, limit, offset)
+        def store(pipeline):
+            source = None if skey == self.key else skey
+            for index, min, max in reversed(ranges):
+                if source is None:
+                    pipeline.zunionstore(zkey, [index])
+                else:
+                    pipeline.zinterstore(zkey, {source: 0, index: 1})
+                if min != '-inf':
+                    pipeline.zremrangebyscore(zkey, '-inf',
+                                              _complement_bound(min))
+                if max != '+inf':
+                    pipeline.zremrangebyscore(zkey, _complement_bound(max),
+                                              '+inf')
+                source = zkey
+        self._store_temp_key(zkey, store)
+        return zkey
+
+    def _zrange(self, zkey):
+        """
+        Returns the ids of the sorted set ``zkey`` by score, within the
+        limit and offset of the collection.
+        """
+        num, start = self._get_limit_and_offset()
+        if num is None:
+            return self.db.zrange(zkey, 0, -1)
+        if num <= 0:
+            return []
+        return self.db.zrange(zkey, start, start + num - 1)
 
     def _order(self, skey):
         """
@@ -435,41 +1111,137 @@ class ModelSet(Set):
                 ordering = ordering.lstrip('-')
             else:
                 desc = False
-            new_set_key = "%s#%s.%s" % (old_set_key, ordering, id(self))
+            new_set_key = self._temp_key('sort', old_set_key, ordering,
+                                         alpha, desc, start, num)
             by = "%s->%s" % (self.model_class._key['*'], ordering)
-            self.db.sort(old_set_key,
-                         by=by,
-                         store=new_set_key,
-                         alpha=alpha,
-                         start=start,
-                         num=num,
-                         desc=desc)
-            if old_set_key != self.key:
-                Set(old_set_key).set_expire()
-            new_list = List(new_set_key)
-            new_list.set_expire()
-            return new_list
+            self._store_temp_key(new_set_key, lambda pipeline:
+                    pipeline.sort(old_set_key,
+                                  by=by,
+                                  store=new_set_key,
+                                  alpha=alpha,
+                                  start=start,
+                                  num=num,
+                                  desc=desc))
+            return List(new_set_key)
 
     def _set_without_ordering(self, skey):
         """
         Final call for "non-ordered" looked up.
         We order by id anyway and this is done by redis (same as above).
+        The generated ids (see the ``id_generator`` option) are sorted
+        lexicographically.
 
         :returns: A Set of `id`
         """
         # sort by id
         num, start = self._get_limit_and_offset()
         old_set_key = skey
-        new_set_key = "%s#.%s" % (old_set_key, id(self))
-        self.db.sort(old_set_key,
-                     store=new_set_key,
-                     start=start,
-                     num=num)
-        if old_set_key != self.key:
-            Set(old_set_key).set_expire()
-        new_list = List(new_set_key)
-        new_list.set_expire()
-        return new_list
+        alpha = self.model_class._id_generator is not None
+        new_set_key = self._temp_key('sort', old_set_key, alpha, start, num)
+        self._store_temp_key(new_set_key, lambda pipeline:
+                pipeline.sort(old_set_key,
+                              store=new_set_key,
+                              alpha=alpha,
+                              start=start,
+                              num=num))
+        return List(new_set_key)
+
+    def _query_script(self, with_hashes=False):
+        """
+        Looks up the collection with a single call of the ``QUERY``
+        script (see the ``query_engine`` option of ``ModelOptions``) and
+        returns the list of ids, followed by the list of the HGETALL
+        replies of the objects if ``with_hashes`` is True.
+        """
+        key = self.model_class._key
+        filters = self._index_keys(self._filters)
+        exclusions = self._index_keys(self._exclusions)
+        ranges = self._zfilter_ranges()
+        num, start = self._get_limit_and_offset()
+        by, desc = '', False
+        alpha = self.model_class._id_generator is not None
+        if self._ordering:
+            ordering, alpha = self._ordering[0]
+            desc = ordering.startswith('-')
+            by = "%s->%s" % (key['*'], ordering.lstrip('-'))
+        elif ranges or self._unordered and num is None:
+            # the ranges are returned in the order of their scores
+            by = 'nosort'
+        args = ([len(filters)] + filters + [len(exclusions)] + exclusions +
+                [len(ranges)] + sum(map(list, ranges), []) +
+                [by, int(alpha), int(desc), start or 0,
+                 '' if num is None else num,
+                 key[''] if with_hashes else ''])
+        return QUERY(self.db, keys=[self.key, "~%s:query" % key], args=args)
+
+    def _fetches_page(self):
+        """
+        Returns True if the objects of the collection are loaded along
+        with their ids by the ``QUERY`` script: the collection is limited
+        and the whole hashes are loaded.
+        """
+        return (self.model_class._query_engine == 'script' and
+                self._limit is not None and
+                self._loaded_fields() is None and
+                not hasattr(self, '_cached_set'))
+
+    def _fetch_page(self):
+        """
+        Looks up the ids and the objects of the collection in one round
+        trip, caches them and returns the list of instances.
+        """
+        ids, hashes = self._query_script(with_hashes=True)
+        instances = [self._build_instance(id, dict(zip(h[::2], h[1::2])))
+                     for id, h in zip(ids, hashes)]
+        if self._select_related:
+            self._fetch_selected_related(instances)
+        if self._prefetch_related:
+            self._fetch_prefetched_related(instances)
+        self._cached_set = ids
+        self._result_cache = instances
+        return instances
+
+    @property
+    def _version(self):
+        """
+        The write version of the model (see ``Model._bump_version``)
+        when the collection was first looked up.
+        """
+        if not hasattr(self, '_cached_version'):
+            self._cached_version = int(
+                    self.db.get(self.model_class._key['_version']) or 0)
+        return self._cached_version
+
+    def _temp_key(self, operation, *args):
+        """
+        Returns the name of the temporary key holding the result of
+        ``operation`` on ``args``. The name is derived from them and
+        from the write version of the model, so that identical queries
+        share their results until the objects of the model change.
+        """
+        digest = hashlib.sha1(repr((operation, args, self._version)))
+        return "~%s:%s:%s" % (self.model_class._key, operation,
+                              digest.hexdigest())
+
+    def _reuse_temp_key(self, key):
+        """
+        Returns True if the temporary ``key`` was already computed by an
+        identical query, extending its expiration.
+        """
+        return self.db.expire(key, redisco.default_expire_time)
+
+    def _store_temp_key(self, key, store):
+        """
+        Computes the temporary ``key`` unless it can be reused (see
+        ``_reuse_temp_key``): ``store`` queues the commands computing it
+        into a transaction, along with the expiration of the key.
+        """
+        if self._reuse_temp_key(key):
+            return
+        pipeline = self.db.pipeline()
+        store(pipeline)
+        pipeline.expire(key, redisco.default_expire_time)
+        pipeline.execute()
 
     def _get_limit_and_offset(self):
         """
@@ -493,6 +1265,335 @@ class ModelSet(Set):
         instance.id = str(id)
         return instance
 
+    def _get_items_with_ids(self, ids):
+        """
+        Fetch the objects of ``ids`` and return the list of instances.
+        See ``_iter_items_with_ids``.
+        """
+        return list(self._iter_items_with_ids(ids))
+
+    def _iter_items_with_ids(self, ids, check_exists=False, members=None):
+        """
+        Fetch the objects of ``ids`` by chunks, each chunk being loaded
+        with a single pipeline, and yield the instances in order.
+        """
+        ids = iter(ids)
+        size = self._chunk_size or redisco.default_chunk_size
+        while True:
+            chunk = list(islice(ids, size))
+            if not chunk:
+                break
+            instances = self._fetch_chunk(chunk, check_exists, members)
+            if self._select_related:
+                self._fetch_selected_related(instances)
+            if self._prefetch_related:
+                self._fetch_prefetched_related(instances)
+            for instance in instances:
+                yield instance
+
+    def _fetch_chunk(self, ids, check_exists=False, members=None):
+        """
+        Load all the objects of ``ids`` in one round trip and return
+        the list of instances.
+
+        If ``check_exists`` is True, the objects that do not exist are
+        skipped. An empty hash is checked against the ``all`` set in the
+        same round trip, unless the model trusts its hashes (see the
+        ``trust_hash`` option of ``ModelOptions``).
+
+        ``members`` is the key of the set of the ids of the collection and
+        the bounds of their scores if it is a sorted set (see
+        ``_members_key``). The objects that are not part of it are
+        skipped, checking it in the same round trip.
+        """
+        fields = self._loaded_fields()
+        check_membership = members is not None or check_exists and (
+                fields is not None or not self.model_class._meta['trust_hash'])
+        pipeline = self.db.pipeline(transaction=False)
+        for id in ids:
+            if fields is None:
+                pipeline.hgetall(self.model_class._key[id])
+            elif fields:
+                pipeline.hmget(self.model_class._key[id], fields)
+            else:
+                pipeline.exists(self.model_class._key[id])
+            if members is not None:
+                key, bounds = members
+                if bounds is None:
+                    pipeline.sismember(key, id)
+                else:
+                    pipeline.zscore(key, id)
+            elif check_membership:
+                pipeline.sismember(self.model_class._key['all'], id)
+        results = pipeline.execute()
+        step = 2 if check_membership else 1
+        instances = []
+        for n, id in enumerate(ids):
+            stored_attrs = results[step * n]
+            if fields is not None:
+                stored_attrs = dict((f, v) for f, v in
+                                    zip(fields, stored_attrs or [])
+                                    if v is not None)
+            if members is not None:
+                member = results[step * n + 1]
+                if members[1] is None:
+                    if not member:
+                        continue
+                elif not _score_within(member, *members[1]):
+                    continue
+            elif check_exists and not (stored_attrs or
+                    check_membership and results[step * n + 1]):
+                continue
+            instances.append(self._build_instance(id, stored_attrs, fields))
+        return instances
+
+    def _build_instance(self, id, stored_attrs, fields=None):
+        """
+        Returns the instance of the object ``id`` loaded with
+        ``stored_attrs``, the values of ``fields`` or of the whole hash.
+        """
+        instance = self.model_class()
+        instance._id = str(id)
+        instance._set_stored_attrs(stored_attrs)
+        if fields is not None:
+            instance._deferred_attrs = (
+                    set(self._attribute_names()) - set(fields))
+        instance._indice_keys = None
+        instance._zindice_keys = None
+        return instance
+
+    def _attribute_names(self):
+        """
+        Returns the names of the attributes stored in the hash of the
+        objects. Counters are left out since they are always read live.
+        """
+        return [k for k, v in self.model_class._attributes.iteritems()
+                if not isinstance(v, Counter)]
+
+    def _field_names(self, fields, counters=False):
+        """
+        Returns the attribute names of ``fields``, a reference field
+        being replaced by the attribute holding the id of its target.
+        """
+        if counters:
+            attributes = self.model_class._attributes.keys()
+        else:
+            attributes = self._attribute_names()
+        names = []
+        for field in fields:
+            if field in self.model_class._references:
+                field = self.model_class._references[field].attname
+            if field not in attributes:
+                raise ValueError("%s is not an attribute of %s." %
+                        (field, self.model_class.__name__))
+            names.append(field)
+        return names
+
+    def _loaded_fields(self):
+        """
+        Returns the list of attributes to load with HMGET according to
+        ``only`` and ``defer``, or None if the whole hash is loaded.
+        """
+        if self._only is None and not self._defer:
+            return None
+        if self._only is not None:
+            fields = self._only
+        else:
+            fields = self._attribute_names()
+        return [f for f in fields if f not in self._defer]
+
+    def _claim_bulk_uniques(self, instances, news, size):
+        """
+        Claims the unique values of ``instances`` (see
+        ``Model._claim_uniques``) with one pipeline for each batch of
+        ``size`` instances.
+
+        Returns the uniqueness errors, the claimed values as
+        ``(unique key, value, id)`` tuples and, for each instance, the
+        list of its previous values to release. On conflict all the
+        claims are released. A value used twice in ``instances`` is
+        claimed by the first one.
+        """
+        errors, claimed, released = [], [], []
+        if not self.model_class._uniques:
+            return errors, claimed, [[]] * len(instances)
+        for i in xrange(0, len(instances), size):
+            chunk = instances[i:i + size]
+            pipeline = self.db.pipeline()
+            claims = [o._queue_unique_claims(o in news, pipeline)
+                      for o in chunk]
+            results = iter(pipeline.execute())
+            for instance, claim in zip(chunk, claims):
+                e, c, r = instance._unique_claim_results(instance in news,
+                                                         claim, results)
+                instance._errors.extend(e)
+                errors.extend(e)
+                claimed.extend((k, v, instance.id) for k, v in c)
+                released.append(r)
+        if errors:
+            self.model_class._release_uniques(
+                    [(k, v) for k, v, id in claimed], self.db)
+        return errors, claimed, released
+
+    def _update_values(self, kwargs):
+        """
+        Returns the attributes set by ``update`` mapped to their new
+        value, a reference field being replaced by the attribute holding
+        the id of its target.
+
+        Raises a ``FieldValidationError`` if a value is not valid.
+        """
+        instance = self.model_class()
+        names = []
+        for field, value in kwargs.iteritems():
+            if field in self.model_class._uniques:
+                raise ValueError("%s is unique and cannot be updated in bulk."
+                        % field)
+            if isinstance(self.model_class._attributes.get(field), Counter):
+                raise ValueError("%s is a counter and cannot be updated "
+                        "in bulk." % field)
+            names.extend(self._field_names([field]))
+            setattr(instance, field, value)
+        errors = []
+        for att in names:
+            try:
+                self.model_class._attributes[att].validate(instance)
+            except FieldValidationError, e:
+                errors.extend(e.errors)
+        if errors:
+            raise FieldValidationError(errors)
+        return dict((att, getattr(instance, att)) for att in names)
+
+    def _update_instances(self, values):
+        """
+        Fallback of ``update`` for the models having indices defined in
+        Meta: the objects are loaded by chunks and written in a transaction
+        that WATCHes their hashes and their sets of indices, retried up to
+        ``save_retries`` times if another client modified them. The objects
+        deleted in the meantime are skipped.
+        """
+        key = self.model_class._key
+        ids = list(self._set)
+        size = self._chunk_size or redisco.default_chunk_size
+        updated = 0
+        for i in xrange(0, len(ids), size):
+            chunk = ids[i:i + size]
+            pipeline = self.db.pipeline()
+            for attempt in xrange(self.model_class._save_retries):
+                try:
+                    pipeline.watch(*([key[id] for id in chunk] +
+                                     [key[id]['_indices'] for id in chunk]))
+                    instances = self._fetch_chunk(chunk, check_exists=True)
+                    pipeline.multi()
+                    for instance in instances:
+                        for att, value in values.iteritems():
+                            setattr(instance, att, value)
+                        instance._write(pipeline=pipeline)
+                    pipeline.execute()
+                    break
+                except WatchError:
+                    continue
+                finally:
+                    pipeline.reset()
+            else:
+                raise WatchError("The objects of %s were modified by another "
+                        "client %d times." % (self.model_class.__name__,
+                                              self.model_class._save_retries))
+            updated += len(instances)
+        self._reset_cache()
+        return updated
+
+    def _reset_cache(self):
+        """
+        Forgets the ids and the objects looked up by the collection, after
+        it was modified by ``delete`` or ``update``.
+        """
+        if hasattr(self, '_result_cache'):
+            del self._result_cache
+        if hasattr(self, '_cached_set'):
+            del self._cached_set
+        if hasattr(self, '_cached_key'):
+            del self._cached_key
+        if hasattr(self, '_cached_version'):
+            del self._cached_version
+
+    def _values_fields(self, fields):
+        """
+        Returns the fields to read for ``values`` and ``values_list``.
+        """
+        if not fields:
+            return ['id'] + self.model_class._attributes.keys()
+        return [f if f == 'id' else self._field_names([f], counters=True)[0]
+                for f in fields]
+
+    def _iter_rows(self, fields):
+        """
+        Yields, for each object of the collection, the tuple of the
+        typecast values of ``fields``, with one pipeline of HMGET for
+        each chunk of objects.
+        """
+        attributes = self.model_class._attributes
+        stored = [f for f in fields if f != 'id']
+        ids = list(self._set)
+        size = self._chunk_size or redisco.default_chunk_size
+        for i in xrange(0, len(ids), size):
+            chunk = ids[i:i + size]
+            if stored:
+                pipeline = self.db.pipeline(transaction=False)
+                for id in chunk:
+                    pipeline.hmget(self.model_class._key[id], stored)
+                results = pipeline.execute()
+            else:
+                results = [[]] * len(chunk)
+            for id, values in zip(chunk, results):
+                values = dict(zip(stored, values))
+                row = []
+                for f in fields:
+                    if f == 'id':
+                        row.append(id)
+                    elif values[f] is None:
+                        row.append(attributes[f].default)
+                    else:
+                        row.append(attributes[f].typecast_for_read(values[f]))
+                yield tuple(row)
+
+    def _fetch_selected_related(self, instances):
+        """
+        Load the targets of the reference fields listed by
+        ``select_related`` for all the ``instances`` and cache them
+        on the instances.
+        """
+        for field in self._select_related:
+            descriptor = self.model_class._references[field]
+            ids = set(getattr(o, descriptor.attname) for o in instances)
+            ids.discard(None)
+            targets = descriptor.value_type().objects.in_bulk(ids)
+            for instance in instances:
+                setattr(instance, '_' + descriptor.name,
+                        targets.get(getattr(instance, descriptor.attname)))
+
+    def _fetch_prefetched_related(self, instances):
+        """
+        Load the related sets listed by ``prefetch_related`` for all the
+        ``instances`` and cache them on the instances.
+        """
+        for related_name in self._prefetch_related:
+            model_class, attribute = self.model_class._related[related_name]
+            manager = model_class.objects
+            pipeline = self.db.pipeline(transaction=False)
+            for o in instances:
+                pipeline.sort(model_class._key[attribute.attname][o.id],
+                              alpha=model_class._id_generator is not None)
+            results = pipeline.execute()
+            related = manager.in_bulk(set(sum(results, [])))
+            for instance, ids in zip(instances, results):
+                related_set = manager.filter(
+                        **{attribute.attname: instance.id})
+                ids = [id for id in ids if id in related]
+                related_set._cached_set = ids
+                related_set._result_cache = [related[id] for id in ids]
+                instance._prefetched[related_name] = related_set
+
     def _build_key_from_filter_item(self, index, value):
         """
         Build the keys from the filter so we can fetch the good keys
@@ -526,5 +1627,11 @@ class ModelSet(Set):
             c._ordering = self._ordering
         c._limit = self._limit
         c._offset = self._offset
+        c._chunk_size = self._chunk_size
+        c._select_related = self._select_related
+        c._prefetch_related = self._prefetch_related
+        c._only = self._only
+        c._defer = self._defer
+        c._unordered = self._unordered
         return c
 
@@ -0,0 +1,374 @@
+"""
+Lua scripts executed on the Redis server by the models.
+"""
+from redis.client import Script
+
+
+class LuaScript(object):
+    """
+    A Lua script sent with EVALSHA (and loaded on the first call) to
+    the client or pipeline given when it is called.
+    """
+    def __init__(self, source):
+        self.source = source
+        self._script = None
+
+    def __call__(self, client, keys=[], args=[]):
+        if self._script is None:
+            self._script = Script(client, self.source)
+        return self._script(keys=keys, args=args, client=client)
+
+
+# Saves an object: uniques, membership, indices, hash and lists.
+#
+# KEYS: the object hash, the ``all`` set, the ``_indices`` set and the
+#       ``_zindices`` set of the object, and the write version of the
+#       model.
+# ARGV: the id of the object, followed by the sections below, each one
+#       starting with its number of entries:
+#       - the fields to set in the hash: field, value
+#       - the fields to delete from the hash: field
+#       - the unique attributes: unique hash, field, has value (0/1), value
+#       - the index sets of the object: key
+#       - the prefixes of the stored index keys to keep: prefix
+#       - the sorted set indices of the object: key, score
+#       - the lists to write: key, append (0/1), number of values,
+#         values... The list is replaced unless the values are appended.
+#
+# Returns the list of the unique fields whose value is already used by
+# another object, in which case nothing is written.
+SAVE_OBJECT = LuaScript("""
+local obj, all, indices, zindices = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local version = KEYS[5]
+local pos = 0
+local function arg()
+    pos = pos + 1
+    return ARGV[pos]
+end
+local id = arg()
+
+local hset = {}
+for i = 1, tonumber(arg()) do
+    local field = arg()
+    local value = arg()
+    table.insert(hset, field)
+    table.insert(hset, value)
+end
+local hdel = {}
+for i = 1, tonumber(arg()) do
+    table.insert(hdel, arg())
+end
+
+local uniques, conflicts = {}, {}
+for i = 1, tonumber(arg()) do
+    local unique = arg()
+    local field = arg()
+    local has_value = arg() == '1'
+    local value = arg()
+    if has_value then
+        local owner = redis.call('HGET', unique, value)
+        if owner and owner ~= id then
+            table.insert(conflicts, field)
+        end
+    end
+    table.insert(uniques, {unique, field, has_value, value})
+end
+if #conflicts > 0 then
+    return conflicts
+end
+for _, u in ipairs(uniques) do
+    local unique, field, has_value, value = u[1], u[2], u[3], u[4]
+    local old = redis.call('HGET', obj, field)
+    if old and (not has_value or old ~= value) and
+            redis.call('HGET', unique, old) == id then
+        redis.call('HDEL', unique, old)
+    end
+    if has_value then
+        redis.call('HSET', unique, value, id)
+    end
+end
+
+redis.call('SADD', all, id)
+
+local new = {}
+for i = 1, tonumber(arg()) do
+    new[arg()] = true
+end
+local kept = {}
+for i = 1, tonumber(arg()) do
+    table.insert(kept, arg())
+end
+local function is_kept(key)
+    for _, prefix in ipairs(kept) do
+        if string.sub(key, 1, #prefix) == prefix then
+            return true
+        end
+    end
+    return false
+end
+for _, key in ipairs(redis.call('SMEMBERS', indices)) do
+    if new[key] then
+        new[key] = nil
+    elseif not is_kept(key) then
+        redis.call('SREM', key, id)
+        redis.call('SREM', indices, key)
+    end
+end
+for key in pairs(new) do
+    redis.call('SADD', key, id)
+    redis.call('SADD', indices, key)
+end
+
+local znew = {}
+for i = 1, tonumber(arg()) do
+    local key = arg()
+    znew[key] = arg()
+end
+for _, key in ipairs(redis.call('SMEMBERS', zindices)) do
+    if not znew[key] then
+        redis.call('ZREM', key, id)
+        redis.call('SREM', zindices, key)
+    end
+end
+for key, score in pairs(znew) do
+    redis.call('ZADD', key, score, id)
+    redis.call('SADD', zindices, key)
+end
+
+if #hset > 0 then
+    redis.call('HMSET', obj, unpack(hset))
+end
+if #hdel > 0 then
+    redis.call('HDEL', obj, unpack(hdel))
+end
+
+for i = 1, tonumber(arg()) do
+    local key = arg()
+    local values = {}
+    if arg() == '0' then
+        redis.call('DEL', key)
+    end
+    for j = 1, tonumber(arg()) do
+        table.insert(values, arg())
+        if #values == 1000 then
+            redis.call('RPUSH', key, unpack(values))
+            values = {}
+        end
+    end
+    if #values > 0 then
+        redis.call('RPUSH', key, unpack(values))
+    end
+end
+redis.call('INCR', version)
+return {}
+""")
+
+
+# Looks up the ids of a collection, and optionally the objects.
+#
+# KEYS: the ``all`` set of the model and a temporary key, deleted before
+#       returning.
+# ARGV: the index sets to intersect, then the index sets to exclude, each
+#       section starting with its number of keys, then the ranges of the
+#       sorted set indices: number of ranges, then key, min, max. They are
+#       followed by the pattern of the sort (empty to sort by id, nosort
+#       to keep the order of the scores of the first range), alpha (0/1),
+#       desc (0/1), the offset and the count of the sort (empty when not
+#       limited) and the prefix of the object hashes (empty to return the
+#       ids only). A single range without filters nor exclusions is read
+#       straight from its index with ZRANGEBYSCORE.
+#
+# Returns the list of ids, followed by the list of the HGETALL replies
+# of the objects when the prefix is given.
+QUERY = LuaScript("""
+local all, tmp = KEYS[1], KEYS[2]
+local pos = 0
+local function arg()
+    pos = pos + 1
+    return ARGV[pos]
+end
+
+local key = all
+local filters = {}
+for i = 1, tonumber(arg()) do
+    table.insert(filters, arg())
+end
+if #filters > 0 then
+    redis.call('SINTERSTORE', tmp, key, unpack(filters))
+    key = tmp
+end
+local exclusions = {}
+for i = 1, tonumber(arg()) do
+    table.insert(exclusions, arg())
+end
+if #exclusions > 0 then
+    redis.call('SDIFFSTORE', tmp, key, unpack(exclusions))
+    key = tmp
+end
+
+-- intersect the ranges in reverse order, to keep the scores of the first
+local ranges = {}
+for i = 1, tonumber(arg()) do
+    table.insert(ranges, {arg(), arg(), arg()})
+end
+local by, alpha, desc = arg(), arg() == '1', arg() == '1'
+local offset, count, prefix = arg(), arg(), arg()
+local ids
+if key == all and #ranges == 1 and by == 'nosort' then
+    -- read the range straight from its index
+    local range = {'ZRANGEBYSCORE', ranges[1][1], ranges[1][2], ranges[1][3]}
+    if count ~= '' then
+        table.insert(range, 'LIMIT')
+        table.insert(range, offset)
+        table.insert(range, count)
+    end
+    ids = redis.call(unpack(range))
+    ranges = {}
+end
+for i = #ranges, 1, -1 do
+    local index, min, max = ranges[i][1], ranges[i][2], ranges[i][3]
+    if key == all then
+        redis.call('ZUNIONSTORE', tmp, 1, index)
+    else
+        redis.call('ZINTERSTORE', tmp, 2, key, index, 'WEIGHTS', 0, 1)
+    end
+    key = tmp
+    if min ~= '-inf' then
+        if string.sub(min, 1, 1) == '(' then
+            redis.call('ZREMRANGEBYSCORE', tmp, '-inf', string.sub(min, 2))
+        else
+            redis.call('ZREMRANGEBYSCORE', tmp, '-inf', '(' .. min)
+        end
+    end
+    if max ~= '+inf' then
+        if string.sub(max, 1, 1) == '(' then
+            redis.call('ZREMRANGEBYSCORE', tmp, string.sub(max, 2), '+inf')
+        else
+            redis.call('ZREMRANGEBYSCORE', tmp, '(' .. max, '+inf')
+        end
+    end
+end
+
+if not ids then
+    local sort = {key}
+    if by ~= '' then
+        table.insert(sort, 'BY')
+        table.insert(sort, by)
+    end
+    if count ~= '' then
+        table.insert(sort, 'LIMIT')
+        table.insert(sort, offset)
+        table.insert(sort, count)
+    end
+    if alpha then
+        table.insert(sort, 'ALPHA')
+    end
+    if desc then
+        table.insert(sort, 'DESC')
+    end
+    ids = redis.call('SORT', unpack(sort))
+    redis.call('DEL', tmp)
+end
+
+if prefix == '' then
+    return {ids}
+end
+local hashes = {}
+for i, id in ipairs(ids) do
+    hashes[i] = redis.call('HGETALL', prefix .. id)
+end
+return {ids, hashes}
+""")
+
+
+# Sets values on several objects, for ``ModelSet.update``: hashes and
+# indices of the indexed attributes.
+#
+# KEYS: the ``all`` set and the write version of the model.
+# ARGV: the key of the model, then the sections below, each one starting
+#       with its number of entries:
+#       - the ids of the objects
+#       - the fields to set in the hashes: field, value
+#       - the fields to delete from the hashes: field
+#       - the indexed fields: field, sorted (0/1), has value (0/1), value
+#
+# The objects missing from the ``all`` set are skipped. The objects are
+# moved from the index of their stored value to the one of the new value.
+#
+# Returns the number of updated objects.
+UPDATE_OBJECTS = LuaScript("""
+local all, version = KEYS[1], KEYS[2]
+local pos = 0
+local function arg()
+    pos = pos + 1
+    return ARGV[pos]
+end
+local prefix = arg()
+
+local ids = {}
+for i = 1, tonumber(arg()) do
+    table.insert(ids, arg())
+end
+local hset = {}
+for i = 1, tonumber(arg()) do
+    table.insert(hset, arg())
+    table.insert(hset, arg())
+end
+local hdel = {}
+for i = 1, tonumber(arg()) do
+    table.insert(hdel, arg())
+end
+local indexed = {}
+for i = 1, tonumber(arg()) do
+    local field = arg()
+    local sorted = arg() == '1'
+    local has_value = arg() == '1'
+    local value = arg()
+    table.insert(indexed, {field, sorted, has_value and value})
+end
+
+local updated = 0
+for _, id in ipairs(ids) do
+    if redis.call('SISMEMBER', all, id) == 1 then
+        local obj = prefix .. ':' .. id
+        local indices, zindices = obj .. ':_indices', obj .. ':_zindices'
+        for _, att in ipairs(indexed) do
+            local field, sorted, value = att[1], att[2], att[3]
+            local old = redis.call('HGET', obj, field)
+            if old ~= value then
+                if old then
+                    local index = prefix .. ':' .. field .. ':' .. old
+                    redis.call('SREM', index, id)
+                    redis.call('SREM', indices, index)
+                end
+                if value then
+                    local index = prefix .. ':' .. field .. ':' .. value
+                    redis.call('SADD', index, id)
+                    redis.call('SADD', indices, index)
+                end
+                if sorted then
+                    local zindex = prefix .. ':' .. field
+                    if value then
+                        redis.call('ZADD', zindex, value, id)
+                        redis.call('SADD', zindices, zindex)
+                    else
+                        redis.call('ZREM', zindex, id)
+                        redis.call('SREM', zindices, zindex)
+                    end
+                end
+            end
+        end
+        if #hset > 0 then
+            redis.call('HMSET', obj, unpack(hset))
+        end
+        if #hdel > 0 then
+            redis.call('HDEL', obj, unpack(hdel))
+        end
+        updated = updated + 1
+    end
+end
+if updated > 0 then
+    redis.call('INCR', version)
+end
+return updated
+""")
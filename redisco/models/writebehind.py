@@ -0,0 +1,145 @@
+"""
+Write-behind buffer of the models with the ``write_behind`` option.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import OrderedDict
+import redisco
+
+logger = logging.getLogger('redisco')
+
+
+class WriteBehindBuffer(object):
+    """
+    Buffers the saved objects of the process and writes them with a
+    single pipeline from a background thread, once
+    ``redisco.write_behind_size`` objects are pending or every
+    ``redisco.write_behind_interval`` seconds.
+
+    The buffer holds the changes of the objects taken when they were
+    saved (see ``ObjectChanges``), never the instances, so that the
+    instances can be modified meanwhile. The changes of an object saved
+    several times before being written are merged and written once. The
+    objects are not locked.
+
+    The flusher thread is stopped at exit, waiting for it up to
+    ``redisco.write_behind_exit_timeout`` seconds, and the pending objects
+    are written. The objects saved after that are written right away.
+    """
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._stopped = False
+
+    def add(self, changes):
+        """
+        Queues the write of the ``changes`` of an object.
+        """
+        with self._lock:
+            self._start()
+            pending = self._pending.get(changes.key)
+            if pending is None:
+                self._pending[changes.key] = changes
+            else:
+                pending.merge(changes)
+            full = len(self._pending) >= redisco.write_behind_size
+        if self._stopped:
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    def discard(self, *keys):
+        """
+        Drops the pending writes of the objects of ``keys``, waiting for
+        the writes being flushed if any.
+        """
+        with self._flush_lock:
+            with self._lock:
+                for key in keys:
+                    self._pending.pop(key, None)
+
+    def flush(self):
+        """
+        Writes all the pending objects with a single pipeline.
+
+        If the pipeline fails, the objects are queued again and the error
+        is raised.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+            if not pending:
+                return
+            pipeline = redisco.get_client().pipeline()
+            versions = set()
+            for changes in pending.itervalues():
+                changes.queue(pipeline)
+                versions.add(changes.version_key)
+            for key in versions:
+                pipeline.incr(key)
+            try:
+                pipeline.execute()
+            except Exception:
+                with self._lock:
+                    for key, changes in self._pending.iteritems():
+                        if key in pending:
+                            pending[key].merge(changes)
+                        else:
+                            pending[key] = changes
+                    self._pending = pending
+                raise
+
+    def _start(self):
+        """
+        Starts the flusher thread of the process, dropping the writes
+        inherited from the parent of a forked process.
+        """
+        if self._pid == os.getpid():
+            return
+        if self._pid is None:
+            atexit.register(self._flush_at_exit)
+        self._pid = os.getpid()
+        self._pending = OrderedDict()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid and not self._stopped:
+            self._wakeup.wait(redisco.write_behind_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed, retrying.")
+
+    def _flush_at_exit(self):
+        if self._pid != os.getpid() or self._stopped:
+            return
+        # stop the flusher before the interpreter tears down
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join(redisco.write_behind_exit_timeout)
+        if self._thread.is_alive():
+            logger.error("Write-behind flusher still running at exit, "
+                         "%d pending objects dropped.", len(self._pending))
+            return
+        self.flush()
+
+
+buffer = WriteBehindBuffer()
+
+def flush():
+    """
+    Writes the objects saved by the models with the ``write_behind``
+    option that are still pending.
+    """
+    buffer.flush()
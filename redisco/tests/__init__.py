@@ -5,7 +5,9 @@ from redisco.containerstests import (SetTestCase, ListTestCase, TypedListTestCas
 from redisco.models.basetests import (ModelTestCase, DateFieldTestCase, FloatFieldTestCase,
         BooleanFieldTestCase, ListFieldTestCase, ReferenceFieldTestCase,
         DateTimeFieldTestCase, CounterFieldTestCase, CharFieldTestCase,
-        MutexTestCase,)
+        MutexTestCase, OptimisticSaveTestCase,
+        ScriptSaveTestCase, IdAllocationTestCase, UniqueAttributeTestCase,
+        WriteBehindTestCase, ScriptQueryTestCase,)
 
 import redisco
 REDIS_DB = int(os.environ.get('REDIS_DB', 15)) # WARNING TESTS FLUSHDB!!!
@@ -31,4 +33,10 @@ def all_tests():
     suite.addTest(unittest.makeSuite(MutexTestCase))
     suite.addTest(unittest.makeSuite(HashTestCase))
     suite.addTest(unittest.makeSuite(CharFieldTestCase))
+    suite.addTest(unittest.makeSuite(OptimisticSaveTestCase))
+    suite.addTest(unittest.makeSuite(ScriptSaveTestCase))
+    suite.addTest(unittest.makeSuite(IdAllocationTestCase))
+    suite.addTest(unittest.makeSuite(UniqueAttributeTestCase))
+    suite.addTest(unittest.makeSuite(WriteBehindTestCase))
+    suite.addTest(unittest.makeSuite(ScriptQueryTestCase))
     return suite